@@ -0,0 +1,101 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Cache lives next to the other model.py artifacts
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+ANSWER_CACHE_FILE = os.path.join(TEST_FILES_DIR, 'answer_cache.sqlite3')
+
+# Set NIGHTCRAWLER_ANSWER_CACHE=0 to always ask the model
+ANSWER_CACHE_ENABLED = os.environ.get('NIGHTCRAWLER_ANSWER_CACHE', '1') != '0'
+# Least recently used answers are dropped beyond either limit
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# Eviction runs once per this many stores
+EVICT_EVERY = 50
+
+SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(question):
+    # Case, spacing and trailing punctuation don't change what is being asked
+    return SPACE_RE.sub(' ', question.strip().lower()).rstrip(' ?!.')
+
+
+def context_hash(context):
+    return hashlib.sha256((context or '').encode('utf-8')).hexdigest()
+
+
+def answer_key(question, context, model):
+    raw = '\0'.join([normalize_question(question), context_hash(context), model])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, path=ANSWER_CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stores = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS answers ('
+            ' key TEXT PRIMARY KEY, answer TEXT, model TEXT, created_at REAL, accessed_at REAL, size INTEGER)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at)')
+        self._db.commit()
+
+    def get(self, question, context, model):
+        key = answer_key(question, context, model)
+        with self._lock:
+            row = self._db.execute('SELECT answer FROM answers WHERE key = ?', (key,)).fetchone()
+            if row:
+                self._db.execute('UPDATE answers SET accessed_at = ? WHERE key = ?', (time.time(), key))
+                self._db.commit()
+        return row[0] if row else None
+
+    def put(self, question, context, model, answer):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?)',
+                (answer_key(question, context, model), answer, model, now, now, len(answer.encode('utf-8'))),
+            )
+            self._db.commit()
+            self._stores += 1
+            if self._stores % EVICT_EVERY == 0:
+                self._evict_locked()
+
+    def evict(self):
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        count, total = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM answers').fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._db.execute('SELECT key, size FROM answers ORDER BY accessed_at'):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((key,))
+            count -= 1
+            total -= size
+        self._db.executemany('DELETE FROM answers WHERE key = ?', victims)
+        self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM answers')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,324 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+# Run from anywhere: make the repo modules and fake_tor importable
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_tor import FakeConfig, FakeTor, WORDS, site_host
+
+# End-to-end benchmark of the crawl, monitor and Q&A pipelines against local
+# stand-ins for Tor, Ahmia, onion sites and the chat endpoint (see fake_tor.py).
+# Each stage runs in its own process so CPU time and peak RSS are per stage.
+STAGES = ('crawl', 'recursive', 'monitor', 'model')
+QUESTIONS = ('which vendors accept monero', 'what is the escrow policy', 'how does shipping work',
+             'where is the pgp key', 'are there mirror links', 'what do reviews say about prices')
+
+# (label, histogram name, label filter) reported per stage
+STAGE_LATENCIES = {
+    'crawl': [('search', 'search_seconds', {}), ('fetch', 'fetch_seconds', {'stage': 'crawl'}),
+              ('parse', 'parse_seconds', {})],
+    'recursive': [('search', 'search_seconds', {}), ('fetch', 'fetch_seconds', {'stage': 'crawl'}),
+                  ('parse', 'parse_seconds', {})],
+    'monitor': [('fetch', 'fetch_seconds', {'stage': 'monitor'}), ('parse', 'parse_seconds', {})],
+    'model': [('load', 'load_seconds', {}), ('index', 'index_seconds', {}), ('retrieve', 'retrieve_seconds', {}),
+              ('llm call', 'llm_seconds', {}), ('answer', 'answer_seconds', {})],
+}
+
+
+def quiet(verbose):
+    # The pipelines print per link; keep the benchmark output readable
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+
+
+def prepare_logging(workdir, name):
+    # Configure the root logger first so the modules' basicConfig calls don't
+    # append benchmark noise to test_files/*.log
+    logging.basicConfig(filename=os.path.join(workdir, name), level=logging.INFO,
+                        format='%(asctime)s %(levelname)s:%(message)s')
+
+
+def redirect_metrics(workdir):
+    import metrics
+    metrics.METRICS_PROM_FILE = os.path.join(workdir, 'metrics.prom')
+    metrics.METRICS_JSON_FILE = os.path.join(workdir, 'metrics.json')
+    metrics.export = functools.partial(metrics.REGISTRY.export, metrics.METRICS_PROM_FILE, metrics.METRICS_JSON_FILE)
+    metrics.REGISTRY.reset()
+    return metrics
+
+
+def point_at_fake_tor(module, ports):
+    import tor_pool
+    tor_pool.TOR_SOCKS_PORT = ports['socks']
+    module.TOR_CONTROL_PORT = ports['control']
+
+
+def setup_crawl(args, ports, workdir):
+    prepare_logging(workdir, 'main.log')
+    import main_script
+    point_at_fake_tor(main_script, ports)
+    main_script.KEYWORDS_FILE = os.path.join(workdir, 'keywords.txt')
+    main_script.RESULTS_FILE = os.path.join(workdir, 'searched_links.json')
+    main_script.PAGE_STORE_DIR = os.path.join(workdir, 'page_store')
+    main_script.skip_log.path = os.path.join(workdir, 'skipped_links.log')
+    # Only Ahmia is simulated
+    for engine in main_script.SEARCH_ENGINES:
+        engine['enabled'] = engine['name'] == 'Ahmia'
+    rng = random.Random(args.seed)
+    with open(main_script.KEYWORDS_FILE, 'w', encoding='utf-8') as f:
+        for i in range(args.keywords):
+            f.write(f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}\n")
+    return main_script
+
+
+def run_crawl(args, ports, workdir):
+    main_script = setup_crawl(args, ports, workdir)
+    metrics = redirect_metrics(workdir)
+    if args.use_async:
+        asyncio.run(main_script.async_main())
+    else:
+        main_script.main()
+    with open(main_script.RESULTS_FILE, 'r', encoding='utf-8') as f:
+        results = len(json.load(f))
+    fetches = metrics.REGISTRY.summary('fetch_seconds', stage='crawl')['count']
+    return {'items': fetches, 'unit': 'pages', 'results': results,
+            'mirrors': metrics.REGISTRY.counter_total('mirrors_total')}
+
+
+def run_recursive(args, ports, workdir):
+    main_script = setup_crawl(args, ports, workdir)
+    import frontier
+    metrics = redirect_metrics(workdir)
+    main_script.CRAWL_RESULTS_JSONL_FILE = os.path.join(workdir, 'crawled_pages.jsonl')
+    main_script.Frontier = functools.partial(frontier.Frontier, os.path.join(workdir, 'crawl_frontier.sqlite3'),
+                                             os.path.join(workdir, 'crawl_visited.bloom'))
+    main_script.RECURSIVE_MAX_PAGES = args.recursive_pages
+    main_script.RECURSIVE_HOST_DELAY = args.host_delay
+    main_script.recursive_main()
+    fetches = metrics.REGISTRY.summary('fetch_seconds', stage='crawl')['count']
+    return {'items': fetches, 'unit': 'pages',
+            'results': metrics.REGISTRY.counter_total('recursive_pages_total', outcome='ok')}
+
+
+def run_monitor(args, ports, workdir):
+    prepare_logging(workdir, 'monitor.log')
+    import monitor
+    import monitor_store
+    metrics = redirect_metrics(workdir)
+    point_at_fake_tor(monitor, ports)
+    monitor.MONITOR_LINKS_FILE = os.path.join(workdir, 'monitor_links.txt')
+    monitor.HASHES_FILE = os.path.join(workdir, 'monitor_hashes.json')
+    monitor.LOG_FILE = os.path.join(workdir, 'monitor.log')
+    monitor.MonitorStore = functools.partial(monitor_store.MonitorStore,
+                                             os.path.join(workdir, 'monitor_state.sqlite3'))
+    # Compress hours of scheduling into the benchmark window
+    monitor.DEFAULT_INTERVAL = args.monitor_interval
+    monitor.MIN_INTERVAL = args.monitor_interval / 4
+    monitor.MAX_INTERVAL = args.monitor_interval * 4
+    with open(monitor.MONITOR_LINKS_FILE, 'w', encoding='utf-8') as f:
+        for i in range(args.monitor_links):
+            f.write(f"http://{site_host(i)}/\n")
+    # monitor.main() never returns; sample it after a fixed window
+    threading.Thread(target=monitor.main, daemon=True).start()
+    time.sleep(args.monitor_seconds)
+    checks = metrics.REGISTRY.counter_total('monitor_checks_total')
+    changed = metrics.REGISTRY.counter_total('monitor_checks_total', outcome='changed')
+    return {'items': checks, 'unit': 'checks', 'changed': changed}
+
+
+def synthetic_results(args):
+    rng = random.Random(args.seed)
+    results = []
+    for k in range(args.model_keywords):
+        keyword = f"keyword {k}"
+        for i in range(args.model_pages):
+            words = ' '.join(rng.choice(WORDS) for _ in range(args.page_kb * 1024 // 7))
+            results.append({'keyword': keyword, 'title': f"page {i}", 'heading': '',
+                            'link': f"http://{site_host(k * args.model_pages + i)}/", 'content': words})
+    return results
+
+
+def run_model(args, ports, workdir):
+    prepare_logging(workdir, 'model.log')
+    os.environ['HF_API_URL'] = ports['chat_url']
+    os.environ['HF_API_KEY'] = 'bench'
+    if not args.answer_cache:
+        os.environ['NIGHTCRAWLER_ANSWER_CACHE'] = '0'
+    import model
+    from retrieval import PassageIndex
+    from answer_cache import AnswerCache
+    from page_store import PageStore
+    metrics = redirect_metrics(workdir)
+    model.LLM_RATE_LIMIT = args.llm_rate
+    model.AnswerCache = functools.partial(AnswerCache, os.path.join(workdir, 'answer_cache.sqlite3'))
+    model.PAGE_STORE_DIR = os.path.join(workdir, 'page_store')
+    PageStore(model.PAGE_STORE_DIR).add(synthetic_results(args))
+    with metrics.timer('load_seconds'):
+        results = model.load_results()
+    index = PassageIndex(os.path.join(workdir, 'retrieval_index.sqlite3'))
+    with metrics.timer('index_seconds'):
+        index.update(results, model.get_page_store().get)
+    answers = 0
+    for k in range(args.model_keywords):
+        keyword = f"keyword {k}"
+        with metrics.timer('load_seconds', keyword=keyword):
+            texts = [c['text'] for c in model.fetch_all_pages(model.get_links_for_keyword(results, keyword))]
+        chunks = list(model.iter_chunks(texts))
+        for i in range(args.questions):
+            question = QUESTIONS[i % len(QUESTIONS)]
+            with metrics.timer('retrieve_seconds'):
+                passages = index.search(question, keyword, model.RETRIEVAL_TOP_K)
+            with metrics.timer('answer_seconds', mode='retrieval'):
+                model.stream_answer(question, model.build_retrieval_context(passages), 'bench')
+            with metrics.timer('answer_seconds', mode='map_reduce'):
+                model.map_reduce_answer(question, chunks, 'bench')
+            answers += 2
+    return {'items': answers, 'unit': 'answers', 'llm_calls': metrics.REGISTRY.summary('llm_seconds')['count']}
+
+
+RUNNERS = {'crawl': run_crawl, 'recursive': run_recursive, 'monitor': run_monitor, 'model': run_model}
+
+
+def run_stage(stage, args, ports, workdir, queue):
+    # Child process entry point: run one stage, report timings back to the parent
+    quiet(args.verbose)
+    if not args.http_cache:
+        os.environ['NIGHTCRAWLER_HTTP_CACHE'] = '0'
+    else:
+        import http_cache
+        http_cache.get_cache = functools.lru_cache(maxsize=1)(
+            lambda: http_cache.ResponseCache(os.path.join(workdir, 'http_cache.sqlite3')))
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    report = RUNNERS[stage](args, ports, workdir)
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    import metrics
+    report.update({
+        'stage': stage, 'wall_seconds': wall,
+        'cpu_seconds': (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime),
+        'peak_rss_mb': after.ru_maxrss / 1024,  # ru_maxrss is KiB on Linux
+        'throughput': report['items'] / wall if wall else 0.0,
+        'latencies': {label: metrics.REGISTRY.summary(name, **labels)
+                      for label, name, labels in STAGE_LATENCIES[stage]},
+    })
+    queue.put(report)
+    # Flush the queue's feeder thread before the hard exit below
+    queue.close()
+    queue.join_thread()
+    sys.stdout.flush()
+    # monitor.main() is still running on a daemon thread; skip interpreter teardown
+    os._exit(0)
+
+
+def format_ms(value):
+    return f"{value * 1000:.1f}" if value is not None else '-'
+
+
+def print_report(reports, fake_stats):
+    print(f"\n{'stage':<11}{'wall s':>8}{'items':>8}{'unit':>9}{'per s':>9}{'cpu s':>8}{'cpu %':>7}{'rss MB':>8}")
+    for r in reports:
+        cpu_pct = 100 * r['cpu_seconds'] / r['wall_seconds'] if r['wall_seconds'] else 0
+        print(f"{r['stage']:<11}{r['wall_seconds']:>8.2f}{r['items']:>8}{r['unit']:>9}{r['throughput']:>9.2f}"
+              f"{r['cpu_seconds']:>8.2f}{cpu_pct:>7.0f}{r['peak_rss_mb']:>8.1f}")
+    print(f"\n{'stage':<11}{'step':<10}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for r in reports:
+        for label, s in r['latencies'].items():
+            print(f"{r['stage']:<11}{label:<10}{s['count']:>8}{format_ms(s['p50']):>10}"
+                  f"{format_ms(s['p99']):>10}{format_ms(s['mean']):>10}")
+    print(f"\nFake Tor: {json.dumps(fake_stats)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline end-to-end benchmark against a local fake Tor.')
+    parser.add_argument('--stages', default=','.join(STAGES), help='comma-separated: crawl,recursive,monitor,model')
+    parser.add_argument('--latency-ms', type=float, default=200, help='onion response latency')
+    parser.add_argument('--jitter-ms', type=float, default=100, help='+/- uniform jitter on every latency')
+    parser.add_argument('--connect-ms', type=float, default=0, help='extra delay per SOCKS CONNECT')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='share of onion responses that are 503s')
+    parser.add_argument('--page-kb', type=int, default=20, help='landing page size')
+    parser.add_argument('--sites', type=int, default=300, help='distinct onion sites behind the search results')
+    parser.add_argument('--results-per-page', type=int, default=10, help='search hits per result page')
+    parser.add_argument('--keywords', type=int, default=10, help='crawl: keywords searched')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='crawl: use the asyncio pipeline')
+    parser.add_argument('--http-cache', action='store_true', help='use a (fresh) HTTP cache instead of bypassing it')
+    parser.add_argument('--recursive-pages', type=int, default=200, help='recursive: pages fetched')
+    parser.add_argument('--host-delay', type=float, default=0.5, help='recursive: politeness delay per host (s)')
+    parser.add_argument('--site-links', type=int, default=5, help='links from each onion page to other sites')
+    parser.add_argument('--mirror-fraction', type=float, default=0.0,
+                        help='share of onion sites that are mirrors of a few shared pages')
+    parser.add_argument('--monitor-links', type=int, default=100, help='monitor: links watched')
+    parser.add_argument('--monitor-seconds', type=float, default=20, help='monitor: how long to let it run')
+    parser.add_argument('--monitor-interval', type=float, default=4, help='monitor: starting poll interval (s)')
+    parser.add_argument('--change-period', type=float, default=6, help='seconds between versions of dynamic sites')
+    parser.add_argument('--model-keywords', type=int, default=2, help='model: keywords asked about')
+    parser.add_argument('--model-pages', type=int, default=25, help='model: pages per keyword')
+    parser.add_argument('--questions', type=int, default=3, help='model: questions per keyword')
+    parser.add_argument('--llm-latency-ms', type=float, default=300, help='chat endpoint latency')
+    parser.add_argument('--llm-error-rate', type=float, default=0.1, help='share of chat calls answered 429')
+    parser.add_argument('--llm-rate', type=float, default=0, help='model: LLM_RATE_LIMIT (0 = unlimited)')
+    parser.add_argument('--answer-cache', action='store_true', help='model: keep the answer cache on')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='also write the raw report as JSON here')
+    parser.add_argument('--verbose', action='store_true', help="show the pipelines' own output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        sys.exit(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+    config = FakeConfig(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate,
+                        page_kb=args.page_kb, sites=args.sites, results_per_page=args.results_per_page,
+                        site_links=args.site_links, mirror_fraction=args.mirror_fraction,
+                        change_period=args.change_period, connect_latency=args.connect_ms / 1000,
+                        llm_latency=args.llm_latency_ms / 1000, llm_error_rate=args.llm_error_rate, seed=args.seed)
+    fake = FakeTor(config).start()
+    ports = {'socks': fake.socks_port, 'control': fake.control_port, 'chat_url': fake.chat_url}
+    print(f"Fake Tor up: SOCKS {fake.socks_port}, control {fake.control_port}, chat {fake.chat_url}")
+    # spawn: every stage starts from a clean interpreter, so RSS and CPU are its own
+    ctx = multiprocessing.get_context('spawn')
+    reports = []
+    workdir = tempfile.mkdtemp(prefix='nightcrawler-bench-')
+    try:
+        for stage in stages:
+            print(f"Running {stage} ...", flush=True)
+            stage_dir = os.path.join(workdir, stage)
+            os.makedirs(stage_dir)
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_stage, args=(stage, args, ports, stage_dir, queue))
+            proc.start()
+            try:
+                reports.append(queue.get(timeout=max(600, args.monitor_seconds * 2)))
+            except Exception:
+                print(f"[!] {stage} did not report back (exit code {proc.exitcode})")
+            proc.join(10)
+    finally:
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_report(reports, fake.stats())
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'stages': reports, 'fake_tor': fake.stats()}, f, indent=2)
+        print(f"[✓] Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import glob
+import os
+import random
+import sys
+import time
+
+# Run from anywhere: make the repo modules importable
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from bs4 import BeautifulSoup
+from html_text import available_backends, html_to_text
+
+# Saved onion pages (*.html) to benchmark against
+CORPUS_DIR = os.path.join(BASE_DIR, 'test_files', 'pages')
+SYNTHETIC_PAGES = 200
+ROUNDS = 3
+
+WORDS = ('market vendor escrow bitcoin monero forum thread reply login register pgp key '
+         'mirror onion service hidden wiki index listing price shipping review rating').split()
+
+
+def synthetic_page(rng, paragraphs, indent=False):
+    # Roughly the shape of an onion forum/market page: nav, inline JS/CSS, lots of paragraphs.
+    # indent=True pretty-prints it, so there is whitespace between the tags like on most real pages.
+    nl = '\n    ' if indent else ''
+    body = []
+    for i in range(paragraphs):
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+        body.append(f'{nl}<div class="post" id="p{i}">{nl}  <h3>Post {i}</h3>{nl}  <p>{words} <a href="/t/{i}">more</a></p>'
+                    f'{nl}  <!-- tracking {i} -->{nl}  <span>{rng.randint(0, 9999)} views</span>{nl}</div>')
+    return (f'<!DOCTYPE html>{nl}<html>{nl}<head>{nl}<title>Hidden Market</title>'
+            f'{nl}<style>body{{font-family:sans-serif}}</style>{nl}<script>var token="abc";</script>{nl}</head>'
+            f'{nl}<body>{nl}<nav><ul>{nl}<li><a href="/">Home</a></li>{nl}<li><a href="/login">Login</a></li>{nl}</ul></nav>'
+            + ''.join(body) + f'{nl}<footer>&copy; market &amp; co</footer>{nl}</body>{nl}</html>\n')
+
+
+def malformed_page(rng, paragraphs):
+    # Hand-written markup: unclosed p/li/td, stray closing tags, text after </html>
+    rows = ''.join(f'<tr><td>{rng.choice(WORDS)}<td>{rng.randint(1, 999)} BTC' for _ in range(paragraphs))
+    items = ''.join(f'\n<li>{rng.choice(WORDS)} {rng.choice(WORDS)}' for _ in range(paragraphs))
+    return ('<html><head><title>Vendor shop</title>\n<body>\n<h1>Listings</h1>\n'
+            f'<p>{" ".join(rng.choice(WORDS) for _ in range(30))}\n<p>second paragraph</span>\n'
+            f'<table>{rows}</table>\n<ul>{items}</ul>\n<div><b>bold <i>both</b> italic</i>\n'
+            '</body></html>\n<p>Mirror list after the end</p>\nplain trailing text <a href="/x">link</a>\n')
+
+
+def load_corpus():
+    pages = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.html'))):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            pages.append(f.read())
+    if pages:
+        print(f"Loaded {len(pages)} saved pages from {CORPUS_DIR}")
+        return pages
+    # Compact, indented and malformed pages, so the mismatch check can fail
+    rng = random.Random(42)
+    pages = []
+    for i in range(SYNTHETIC_PAGES):
+        if i % 3 == 2:
+            pages.append(malformed_page(rng, rng.randint(5, 100)))
+        else:
+            pages.append(synthetic_page(rng, rng.randint(5, 300), indent=i % 3 == 1))
+    print(f"No saved pages in {CORPUS_DIR}; using {len(pages)} synthetic pages")
+    return pages
+
+
+def main():
+    pages = load_corpus()
+    total_mb = sum(len(p.encode('utf-8')) for p in pages) / (1024 * 1024)
+    reference = [BeautifulSoup(p, 'html.parser').get_text(separator='\n', strip=True) for p in pages]
+    print(f"Corpus size: {total_mb:.1f} MB, {ROUNDS} rounds per backend\n")
+    print(f"{'backend':<14}{'pages/s':>10}{'MB/s':>10}{'speedup':>10}{'mismatches':>12}")
+    baseline = None
+    for backend in reversed(available_backends()):
+        best = None
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            texts = [html_to_text(p, backend) for p in pages]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        mismatches = sum(1 for a, b in zip(texts, reference) if a != b)
+        if baseline is None:
+            baseline = best
+        print(f"{backend:<14}{len(pages) / best:>10.1f}{total_mb / best:>10.2f}{baseline / best:>9.1f}x{mismatches:>12}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+import hashlib
+import json
+import random
+import select
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+# Local stand-ins for Tor and the onion services the crawler talks to:
+#   FakeControlPort - answers the stem Controller (AUTHENTICATE, SIGNAL NEWNYM, ...)
+#   FakeSocksProxy  - SOCKS5 (socks5h + username/password) that sends every
+#                     CONNECT to the fake site server, whatever the .onion host
+#   FakeSiteServer  - Ahmia-style search pages, onion landing pages,
+#                     check.torproject.org and a chat-completions endpoint
+
+AHMIA_HOST = 'juhanurmihxlp77nkq76byazcldy2hlmovfu2epvl5ankdibsot4csyd.onion'
+CHECK_IP_HOST = 'check.torproject.org'
+CHAT_PATH = '/v1/chat/completions'
+
+WORDS = ('market vendor escrow bitcoin monero forum thread reply login register pgp key '
+         'mirror onion service hidden wiki index listing price shipping review rating').split()
+
+
+class FakeConfig:
+    def __init__(self, latency=0.2, jitter=0.1, error_rate=0.05, page_kb=20, sites=300, results_per_page=10,
+                 site_links=5, dynamic_fraction=0.25, change_period=10.0, connect_latency=0.0,
+                 llm_latency=0.3, llm_error_rate=0.1, llm_tokens=60, mirror_fraction=0.0, mirror_groups=5, seed=42):
+        self.latency = latency                    # seconds added to every onion response
+        self.jitter = jitter                      # +/- uniform jitter on top of latency
+        self.error_rate = error_rate              # share of onion responses that are 503s
+        self.page_kb = page_kb                    # landing page size
+        self.sites = sites                        # distinct onion sites search results point at
+        self.results_per_page = results_per_page
+        self.site_links = site_links              # links from each landing page to other sites
+        self.dynamic_fraction = dynamic_fraction  # share of sites whose content changes over time
+        self.change_period = change_period        # seconds between versions of a dynamic site
+        self.connect_latency = connect_latency    # SOCKS CONNECT delay (circuit/rendezvous setup)
+        self.llm_latency = llm_latency
+        self.llm_error_rate = llm_error_rate      # share of chat calls answered 429
+        self.llm_tokens = llm_tokens              # words per chat answer
+        self.mirror_fraction = mirror_fraction    # share of sites serving one of mirror_groups shared pages
+        self.mirror_groups = mirror_groups
+        self.seed = seed
+
+
+def site_host(index):
+    # Deterministic 56-char v3-looking onion name per site
+    digest = hashlib.sha256(f"site-{index}".encode()).hexdigest()
+    return digest[:56] + '.onion'
+
+
+def site_text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def site_page(host, version, config):
+    # Mirrors share their posts (and only differ in the header and link list)
+    pick = random.Random(host)
+    content_key = host
+    if pick.random() < config.mirror_fraction:
+        content_key = f"mirror-{pick.randrange(config.mirror_groups)}"
+    rng = random.Random(f"{content_key}-{version}")
+    paragraphs = max(1, config.page_kb * 1024 // 600)
+    body = ''.join(f'<div class="post"><h3>Post {i}</h3><p>{site_text(rng, 500)}</p>'
+                   f'<a href="/t/{i}">more</a></div>' for i in range(paragraphs))
+    # A link list to other sites, so recursive crawls have somewhere to go.
+    # Mirrors draw their own; other sites continue the body's stream, as before mirrors.
+    if content_key != host:
+        rng = random.Random(f"{host}-{version}")
+    links = ''.join(f'<li><a href="http://{site_host(rng.randrange(config.sites))}/">mirror</a></li>'
+                    for _ in range(config.site_links))
+    return ('<!DOCTYPE html><html><head><title>Hidden Market</title><script>var t=1;</script></head>'
+            f'<body><nav><a href="/">Home</a></nav><h1>{host[:16]}</h1>{body}<ul>{links}</ul></body></html>')
+
+
+def ahmia_page(query, page, config):
+    rng = random.Random(f"{config.seed}-{query}-{page}")
+    items = []
+    for _ in range(config.results_per_page):
+        host = site_host(rng.randrange(config.sites))
+        target = quote(f"http://{host}/", safe='')
+        items.append(f'<li class="result"><h4><a href="/search/redirect?search_term={quote(query)}'
+                     f'&redirect_url={target}">{host[:16]} {rng.choice(WORDS)}</a></h4>'
+                     f'<p>{site_text(rng, 80)}</p></li>')
+    return f'<html><body><ol class="searchResults">{"".join(items)}</ol></body></html>'
+
+
+class FakeSiteHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def delay(self, base):
+        config = self.server.config
+        time.sleep(max(0.0, base + random.uniform(-config.jitter, config.jitter)))
+
+    def do_GET(self):
+        config = self.server.config
+        host = (self.headers.get('Host') or '').split(':')[0]
+        url = urlparse(self.path)
+        self.server.count('get')
+        if host == CHECK_IP_HOST:
+            self.send_body(200, '<html><body><strong>127.0.0.1</strong></body></html>')
+            return
+        self.delay(config.latency)
+        if random.random() < config.error_rate:
+            self.server.count('error')
+            self.send_body(503, '<html><body>503 Service Unavailable</body></html>')
+            return
+        if host == AHMIA_HOST:
+            qs = parse_qs(url.query)
+            self.send_body(200, ahmia_page(qs.get('q', [''])[0], int(qs.get('page', ['0'])[0]), config))
+            return
+        if not host.endswith('.onion'):
+            self.send_body(404, '<html><body>404 Not Found</body></html>')
+            return
+        # Dynamic sites get a new version every change_period seconds
+        version = 0
+        if int(hashlib.md5(host.encode()).hexdigest()[:8], 16) % 1000 < config.dynamic_fraction * 1000:
+            version = int(time.time() / config.change_period)
+        body = site_page(host, version, config)
+        etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_body(200, body, headers={'ETag': etag})
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if urlparse(self.path).path != CHAT_PATH:
+            self.send_body(404, 'not found', 'text/plain')
+            return
+        self.server.count('chat')
+        self.delay(config.llm_latency)
+        if random.random() < config.llm_error_rate:
+            self.server.count('chat_429')
+            self.send_body(429, '{"error": "rate limited"}', 'application/json', {'Retry-After': '0.05'})
+            return
+        rng = random.Random(len(json.dumps(payload)))
+        words = [rng.choice(WORDS) for _ in range(config.llm_tokens)]
+        if not payload.get('stream'):
+            answer = {'choices': [{'message': {'role': 'assistant', 'content': ' '.join(words)}}]}
+            self.send_body(200, json.dumps(answer), 'application/json')
+            return
+        # SSE: one event per word, then [DONE]; the connection closes the body
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for word in words:
+            event = {'choices': [{'delta': {'content': word + ' '}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def ignore_disconnects(server, request, client_address):
+    # Clients hang up mid-response when a crawl cancels pending fetches
+    if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+        socketserver.BaseServer.handle_error(server, request, client_address)
+
+
+class FakeSiteServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+    handle_error = ignore_disconnects
+
+    def __init__(self, config, address=('127.0.0.1', 0)):
+        self.config = config
+        self.counts = {}
+        self._lock = threading.Lock()
+        super().__init__(address, FakeSiteHandler)
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+class FakeSocksHandler(socketserver.BaseRequestHandler):
+    def recv_exact(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError('client closed during handshake')
+            data += chunk
+        return data
+
+    def handle(self):
+        try:
+            self.negotiate()
+        except (ConnectionError, OSError, struct.error):
+            return
+
+    def negotiate(self):
+        server = self.server
+        version, nmethods = self.recv_exact(2)
+        methods = self.recv_exact(nmethods)
+        user = ''
+        if 2 in methods:
+            # RFC 1929 username/password: Tor uses the username for circuit isolation
+            self.request.sendall(b'\x05\x02')
+            _, ulen = self.recv_exact(2)
+            user = self.recv_exact(ulen).decode('utf-8', 'replace')
+            plen = self.recv_exact(1)[0]
+            self.recv_exact(plen)
+            self.request.sendall(b'\x01\x00')
+        else:
+            self.request.sendall(b'\x05\x00')
+        _, cmd, _, atyp = self.recv_exact(4)
+        if atyp == 3:
+            host = self.recv_exact(self.recv_exact(1)[0]).decode('idna')
+        elif atyp == 1:
+            host = socket.inet_ntoa(self.recv_exact(4))
+        else:
+            host = socket.inet_ntop(socket.AF_INET6, self.recv_exact(16))
+        port = struct.unpack('>H', self.recv_exact(2))[0]
+        server.record(user)
+        if cmd != 1 or port != 80:
+            # Only plain-HTTP CONNECTs are simulated; 0x05 = connection refused
+            self.request.sendall(b'\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00')
+            return
+        if server.config.connect_latency:
+            time.sleep(server.config.connect_latency)
+        upstream = socket.create_connection(server.upstream)
+        self.request.sendall(b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00')
+        try:
+            self.pipe(upstream)
+        finally:
+            upstream.close()
+
+    def pipe(self, upstream):
+        sockets = [self.request, upstream]
+        while True:
+            readable, _, _ = select.select(sockets, [], [], 60)
+            if not readable:
+                return
+            for sock in readable:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                (upstream if sock is self.request else self.request).sendall(data)
+
+
+class FakeSocksProxy(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 512
+    handle_error = ignore_disconnects
+
+    def __init__(self, config, upstream, address=('127.0.0.1', 0)):
+        self.config = config
+        self.upstream = upstream
+        self.connections = 0
+        self.circuits = set()
+        self._lock = threading.Lock()
+        super().__init__(address, FakeSocksHandler)
+
+    def record(self, user):
+        with self._lock:
+            self.connections += 1
+            self.circuits.add(user)
+
+
+class FakeControlHandler(socketserver.StreamRequestHandler):
+    def reply(self, text):
+        self.wfile.write(text.encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').strip()
+            command = line.split(' ', 1)[0].upper()
+            if command == 'PROTOCOLINFO':
+                self.reply('250-PROTOCOLINFO 1\r\n250-AUTH METHODS=NULL\r\n'
+                           '250-VERSION Tor="0.4.8.9"\r\n250 OK\r\n')
+            elif command == 'GETINFO' and line.split()[1:] == ['version']:
+                self.reply('250-version=0.4.8.9\r\n250 OK\r\n')
+            elif command == 'GETCONF':
+                self.reply(''.join(f"250 {key}\r\n" for key in line.split()[1:]) or '250 OK\r\n')
+            elif command == 'SIGNAL':
+                self.server.signals += 1
+                self.reply('250 OK\r\n')
+            elif command == 'QUIT':
+                self.reply('250 closing connection\r\n')
+                return
+            else:
+                self.reply('250 OK\r\n')
+
+
+class FakeControlPort(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        self.signals = 0
+        super().__init__(address, FakeControlHandler)
+
+
+class FakeTor:
+    # Starts all three servers on free local ports, each on a daemon thread
+    def __init__(self, config=None):
+        self.config = config or FakeConfig()
+        self.site = FakeSiteServer(self.config)
+        self.socks = FakeSocksProxy(self.config, self.site.server_address)
+        self.control = FakeControlPort()
+        self._threads = []
+
+    @property
+    def socks_port(self):
+        return self.socks.server_address[1]
+
+    @property
+    def control_port(self):
+        return self.control.server_address[1]
+
+    @property
+    def chat_url(self):
+        host, port = self.site.server_address
+        return f"http://{host}:{port}{CHAT_PATH}"
+
+    def start(self):
+        for server in (self.site, self.socks, self.control):
+            t = threading.Thread(target=server.serve_forever, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stats(self):
+        return {'site': dict(self.site.counts), 'socks_connections': self.socks.connections,
+                'circuits': len(self.socks.circuits), 'newnym_signals': self.control.signals}
+
+    def stop(self):
+        for server in (self.site, self.socks, self.control):
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,159 @@
+import hashlib
+import heapq
+import re
+
+# Words per shingle and how many shingle hashes are kept per page (bottom-k sketch)
+SHINGLE_SIZE = 4
+SKETCH_SIZE = 128
+# Per-line block hashes for the "what changed" summary: a bottom-k sketch,
+# so a fingerprint stays small however long the page is
+BLOCK_SKETCH_SIZE = 256
+# Digits are masked before hashing so counters, clocks and dates don't count as edits,
+# and so are tokens mixing letters and digits (captchas, session ids, nonces) and
+# very long words (hashes, base64 blobs)
+NUMBER_RE = re.compile(r'\d+')
+TOKEN_RE = re.compile(r'\b(?:(?=[a-z]*\d)(?=\d*[a-z])[a-z\d]{4,}|\w{24,})\b')
+SIMHASH_BITS = 64
+# MinHash signature (one-permutation hashing): each shingle hash falls into one of
+# MINHASH_SIZE bins by its low bits and every bin keeps its smallest value
+MINHASH_SIZE = 64
+MINHASH_EMPTY = 2 ** 64
+
+
+def normalize(text):
+    return NUMBER_RE.sub('0', TOKEN_RE.sub('#', text.lower()))
+
+
+def hash64(value):
+    # Stable across runs, unlike the builtin hash()
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    words = normalize(text).split()
+    if not words:
+        return set()
+    if len(words) <= size:
+        return {hash64(' '.join(words))}
+    return {hash64(' '.join(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+def simhash(hashes):
+    # Each hash votes +1/-1 per bit; the sign of the total gives the fingerprint bit
+    if not hashes:
+        return 0
+    half = len(hashes) / 2
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        ones = sum((h >> bit) & 1 for h in hashes)
+        if ones > half:
+            value |= 1 << bit
+    return value
+
+
+def block_hash(line):
+    return hash64(normalize(line)) & 0xFFFFFFFF
+
+
+def block_hashes(text):
+    # One 32-bit hash per distinct non-empty line (html_to_text puts each text
+    # node on its own line); returns (bottom-k sketch, number of distinct lines)
+    blocks = {block_hash(line.strip()) for line in text.split('\n') if line.strip()}
+    return heapq.nsmallest(BLOCK_SKETCH_SIZE, blocks), len(blocks)
+
+
+def fingerprint(text):
+    shingles = shingle_hashes(text)
+    blocks, block_count = block_hashes(text)
+    return {
+        'sha256': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'simhash': simhash(shingles),
+        'shingles': heapq.nsmallest(SKETCH_SIZE, shingles),
+        'blocks': blocks,
+        'block_count': block_count,
+    }
+
+
+def jaccard_estimate(a, b, k=SKETCH_SIZE):
+    # Bottom-k estimate: of the k smallest hashes in the union, how many are in both
+    if not a and not b:
+        return 1.0
+    set_a, set_b = set(a), set(b)
+    union = heapq.nsmallest(k, set_a | set_b)
+    both = sum(1 for h in union if h in set_a and h in set_b)
+    return both / len(union)
+
+
+def simhash_similarity(a, b):
+    return 1 - bin(a ^ b).count('1') / SIMHASH_BITS
+
+
+def block_sketch(fp, k=BLOCK_SKETCH_SIZE):
+    # (sketch, distinct lines, largest hash the sketch is exact up to); also
+    # reads fingerprints stored before the sketch, which kept every block
+    blocks = set(fp['blocks'])
+    count = fp.get('block_count', len(blocks))
+    blocks = set(heapq.nsmallest(k, blocks))
+    cutoff = max(blocks) if count > len(blocks) else float('inf')
+    return blocks, count, cutoff
+
+
+def changed_blocks(old, new):
+    # Estimated (added, removed) line counts: exact below the smaller sketch
+    # cutoff, scaled up to the whole page when a sketch is full
+    old_blocks, old_count, old_cutoff = block_sketch(old)
+    new_blocks, new_count, new_cutoff = block_sketch(new)
+    cutoff = min(old_cutoff, new_cutoff)
+    old_in = {h for h in old_blocks if h <= cutoff}
+    new_in = {h for h in new_blocks if h <= cutoff}
+    added = len(new_in - old_in) * new_count / len(new_in) if new_in else 0
+    removed = len(old_in - new_in) * old_count / len(old_in) if old_in else 0
+    return round(added), round(removed)
+
+
+def compare(old, new, text=None, samples=3):
+    # Similarity between two fingerprints plus a summary of changed blocks.
+    # Pass the new page text to get a few of the added lines back.
+    if old['sha256'] == new['sha256']:
+        return {'similarity': 1.0, 'simhash_similarity': 1.0, 'blocks_added': 0, 'blocks_removed': 0, 'added': []}
+    old_blocks, _, old_cutoff = block_sketch(old)
+    added = []
+    if text is not None:
+        # Lines hashing above the old sketch's cutoff can't be told apart, so
+        # the samples come from the lines the sketch covers
+        for line in text.split('\n'):
+            line = line.strip()
+            if not line or line[:200] in added:
+                continue
+            h = block_hash(line)
+            if h <= old_cutoff and h not in old_blocks:
+                added.append(line[:200])
+                if len(added) >= samples:
+                    break
+    blocks_added, blocks_removed = changed_blocks(old, new)
+    return {
+        'similarity': jaccard_estimate(old['shingles'], new['shingles']),
+        'simhash_similarity': simhash_similarity(old['simhash'], new['simhash']),
+        'blocks_added': blocks_added,
+        'blocks_removed': blocks_removed,
+        'added': added,
+    }
+
+
+def minhash(hashes, size=MINHASH_SIZE):
+    # One pass over the shingles instead of `size` hash permutations
+    signature = [MINHASH_EMPTY] * size
+    for h in hashes:
+        i = h % size
+        v = h // size
+        if v < signature[i]:
+            signature[i] = v
+    return signature
+
+
+def minhash_similarity(a, b):
+    # Estimated Jaccard similarity; bins empty in both pages don't count
+    used = [(x, y) for x, y in zip(a, b) if x != MINHASH_EMPTY or y != MINHASH_EMPTY]
+    if not used:
+        return 1.0
+    return sum(1 for x, y in used if x == y) / len(used)
@@ -0,0 +1,233 @@
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+from urllib.parse import urlparse, urldefrag
+
+# Frontier and visited filter live next to the other crawl state
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+FRONTIER_FILE = os.path.join(TEST_FILES_DIR, 'crawl_frontier.sqlite3')
+VISITED_FILE = os.path.join(TEST_FILES_DIR, 'crawl_visited.bloom')
+
+# Bloom filter sizing: ~14.4 bits per URL at a 0.1% false-positive rate,
+# so 10M URLs cost about 17 MB no matter how long the URLs are
+BLOOM_CAPACITY = 10_000_000
+BLOOM_ERROR_RATE = 0.001
+BLOOM_HEADER = struct.Struct('>QII')  # bits, hashes, count (count saturates at 2**32-1)
+
+# Crawl budgets
+DEFAULT_HOST_BUDGET = 50       # pages fetched per onion host, ever
+DEFAULT_HOST_DELAY = 2.0       # seconds between two fetches from the same host
+
+
+def canonical_url(url):
+    # One spelling per page: lowercase scheme/host, no fragment, no trailing slash
+    url, _ = urldefrag(url.strip())
+    parsed = urlparse(url)
+    path = parsed.path.rstrip('/') or '/'
+    query = '?' + parsed.query if parsed.query else ''
+    return f"{parsed.scheme.lower()}://{(parsed.hostname or '').lower()}{path}{query}"
+
+
+def url_host(url):
+    return (urlparse(url).hostname or '').lower()
+
+
+class BloomFilter:
+    # Fixed-size bit array with k hash positions per item (double hashing over
+    # one blake2b digest). No false negatives; false positives at ~error_rate
+    # until `capacity` items have been added.
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE, bits=None, hashes=None):
+        self.bits = bits or max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        return all(self.array[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item):
+        # Returns True if the item was (probably) not there before
+        positions = self._positions(item)
+        with self._lock:
+            new = False
+            for p in positions:
+                mask = 1 << (p & 7)
+                if not self.array[p >> 3] & mask:
+                    self.array[p >> 3] |= mask
+                    new = True
+            if new:
+                self.count += 1
+            return new
+
+    def save(self, path):
+        # Write-then-rename so a crash never leaves a torn filter
+        tmp_path = path + '.tmp'
+        with self._lock:
+            with open(tmp_path, 'wb') as f:
+                f.write(BLOOM_HEADER.pack(self.bits, self.hashes, min(self.count, 2 ** 32 - 1)))
+                f.write(self.array)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        if not os.path.exists(path):
+            return cls(capacity, error_rate)
+        with open(path, 'rb') as f:
+            bits, hashes, count = BLOOM_HEADER.unpack(f.read(BLOOM_HEADER.size))
+            bloom = cls(bits=bits, hashes=hashes)
+            data = f.read()
+        if len(data) != len(bloom.array):
+            raise ValueError(f"{path} is truncated ({len(data)} of {len(bloom.array)} bytes)")
+        bloom.array[:] = data
+        bloom.count = count
+        return bloom
+
+
+class Frontier:
+    # Persistent priority queue of URLs to crawl (SQLite, WAL). Lower priority
+    # pops first; a host is only handed out again after `host_delay` seconds
+    # and never more than `host_budget` times. Seen URLs are tracked by the
+    # Bloom filter, so finished rows are deleted and the table stays small.
+    def __init__(self, path=FRONTIER_FILE, visited_path=VISITED_FILE, host_budget=DEFAULT_HOST_BUDGET,
+                 host_delay=DEFAULT_HOST_DELAY):
+        self.path = path
+        self.visited_path = visited_path
+        self.host_budget = host_budget
+        self.host_delay = host_delay
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.visited = BloomFilter.load(visited_path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS frontier ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT UNIQUE, host TEXT, depth INTEGER,'
+            ' priority REAL, keyword TEXT, parent TEXT, leased INTEGER DEFAULT 0);'
+            'CREATE INDEX IF NOT EXISTS frontier_order ON frontier (leased, priority, id);'
+            'CREATE INDEX IF NOT EXISTS frontier_host ON frontier (host);'
+            'CREATE TABLE IF NOT EXISTS hosts ('
+            ' host TEXT PRIMARY KEY, fetched INTEGER DEFAULT 0, next_allowed REAL DEFAULT 0);'
+        )
+        # Leases from a crashed run go back in the queue
+        self._db.execute('UPDATE frontier SET leased = 0 WHERE leased = 1')
+        self._db.commit()
+        self.hosts = {h: [fetched, next_allowed, 0] for h, fetched, next_allowed in self._db.execute('SELECT host, fetched, next_allowed FROM hosts')}
+        for host, queued in self._db.execute('SELECT host, COUNT(*) FROM frontier GROUP BY host'):
+            self._host(host)[2] = queued
+
+    def _host(self, host):
+        # [fetched, next_allowed, queued], kept in memory; fetched/next_allowed are
+        # written through to the hosts table
+        if host not in self.hosts:
+            self.hosts[host] = [0, 0.0, 0]
+        return self.hosts[host]
+
+    def _push_locked(self, url, depth, priority, keyword, parent):
+        url = canonical_url(url)
+        host = url_host(url)
+        if not host.endswith('.onion') or url in self.visited:
+            return False
+        state = self._host(host)
+        # Queued plus fetched pages count against the host budget, so one
+        # huge link farm can't flood the frontier. Rejected URLs aren't marked
+        # seen, so a later run with a larger budget can still queue them.
+        if state[0] + state[2] >= self.host_budget:
+            return False
+        self.visited.add(url)
+        cur = self._db.execute(
+            'INSERT OR IGNORE INTO frontier (url, host, depth, priority, keyword, parent) VALUES (?, ?, ?, ?, ?, ?)',
+            (url, host, depth, depth if priority is None else priority, keyword, parent),
+        )
+        state[2] += cur.rowcount
+        return cur.rowcount > 0
+
+    def push(self, url, depth, priority=None, keyword=None, parent=None):
+        # Queue a URL unless it was ever seen before; returns True if queued
+        with self._lock:
+            queued = self._push_locked(url, depth, priority, keyword, parent)
+            self._db.commit()
+        return queued
+
+    def push_many(self, urls, depth, keyword=None, parent=None):
+        # One transaction for all links of a page
+        with self._lock:
+            queued = sum(self._push_locked(u, depth, None, keyword, parent) for u in urls)
+            self._db.commit()
+        return queued
+
+    def pop(self):
+        # Lease the best-priority URL whose host is due. Returns (url, depth, keyword),
+        # or None if nothing is ready right now. The cursor is lazy, so only rows up
+        # to the first due host are read, and the queue isn't read at all while
+        # every host with queued URLs is cooling down.
+        now = time.time()
+        with self._lock:
+            if not any(state[2] > 0 and state[1] <= now for state in self.hosts.values()):
+                return None
+            rows = self._db.execute(
+                'SELECT id, url, host, depth, keyword FROM frontier WHERE leased = 0 ORDER BY priority, id'
+            )
+            for row_id, url, host, depth, keyword in rows:
+                state = self._host(host)
+                if state[1] > now:
+                    continue
+                state[0] += 1
+                state[1] = now + self.host_delay
+                state[2] -= 1
+                self._db.execute('UPDATE frontier SET leased = 1 WHERE id = ?', (row_id,))
+                self._db.execute(
+                    'INSERT INTO hosts (host, fetched, next_allowed) VALUES (?, ?, ?)'
+                    ' ON CONFLICT(host) DO UPDATE SET fetched = excluded.fetched, next_allowed = excluded.next_allowed',
+                    (host, state[0], state[1]),
+                )
+                self._db.commit()
+                return url, depth, keyword
+            return None
+
+    def done(self, url):
+        with self._lock:
+            self._db.execute('DELETE FROM frontier WHERE url = ?', (url,))
+            self._db.commit()
+
+    def next_ready(self):
+        # Seconds until some queued host is due (0 if one is now), None if empty
+        with self._lock:
+            due = [state[1] for state in self.hosts.values() if state[2] > 0]
+        if not due:
+            return None
+        return max(0.0, min(due) - time.time())
+
+    def pending(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM frontier WHERE leased = 0').fetchone()[0]
+
+    def save(self):
+        self.visited.save(self.visited_path)
+
+    def reset(self):
+        with self._lock:
+            self._db.execute('DELETE FROM frontier')
+            self._db.execute('DELETE FROM hosts')
+            self._db.commit()
+            self.hosts = {}
+        self.visited = BloomFilter()
+        if os.path.exists(self.visited_path):
+            os.remove(self.visited_path)
+
+    def close(self):
+        self.save()
+        with self._lock:
+            self._db.close()
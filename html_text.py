@@ -0,0 +1,151 @@
+import html as html_lib
+import os
+import re
+from urllib.parse import urljoin, urldefrag, urlparse
+from bs4 import BeautifulSoup
+import metrics
+
+# Optional fast backends, used when installed
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# Text backend: 'auto' (fastest available), 'lxml', 'selectolax' or 'html.parser'
+PARSER_BACKEND = os.environ.get('NIGHTCRAWLER_PARSER', 'auto')
+
+# BeautifulSoup.get_text() leaves out the contents of these tags
+SKIP_TAGS = frozenset(['script', 'style', 'template'])
+
+# Closing </body> and </html> tags, removed before lxml parses a page
+CLOSING_ROOT_RE = re.compile(r'</(?:body|html)\s*>', re.IGNORECASE)
+
+# Link extraction: href attributes plus onion URLs pasted as plain text
+HREF_RE = re.compile(r'''\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+ONION_URL_RE = re.compile(r'''https?://(?:[a-z2-7]{16}|[a-z2-7]{56})\.onion(?:[/?][^\s"'<>]*)?''', re.IGNORECASE)
+
+
+def soup_builder():
+    # Tree builder for BeautifulSoup: lxml is several times faster than html.parser
+    return 'lxml' if lxml is not None else 'html.parser'
+
+
+def make_soup(html):
+    return BeautifulSoup(html, soup_builder())
+
+
+def available_backends():
+    # Fastest first; html.parser is always there
+    backends = []
+    if LexborHTMLParser is not None:
+        backends.append('selectolax')
+    if lxml is not None:
+        backends.append('lxml')
+    backends.append('html.parser')
+    return backends
+
+
+def _text_html_parser(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    return soup.get_text(separator='\n', strip=True)
+
+
+def _text_lxml(html):
+    # Same walk as get_text(separator='\n', strip=True): every text node in
+    # document order, stripped, empties dropped, comments/script/style skipped.
+    # libxml2 drops whatever follows </html>, which html.parser keeps as text.
+    root = lxml.html.document_fromstring(CLOSING_ROOT_RE.sub('', html))
+    parts = []
+    stack = [(root, False)]
+    while stack:
+        el, done = stack.pop()
+        if done:
+            if el.tail:
+                tail = el.tail.strip()
+                if tail:
+                    parts.append(tail)
+            continue
+        stack.append((el, True))
+        # Comments and processing instructions have a non-string tag
+        if not isinstance(el.tag, str) or el.tag in SKIP_TAGS:
+            continue
+        if el.text:
+            text = el.text.strip()
+            if text:
+                parts.append(text)
+        stack.extend((child, False) for child in reversed(el))
+    return '\n'.join(parts)
+
+
+def _text_selectolax(html):
+    # Stripped text nodes joined by newlines; Node.text(strip=True) would keep
+    # the whitespace-only nodes between tags as blank lines
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(list(SKIP_TAGS))
+    if tree.root is None:
+        return ''
+    parts = []
+    for node in tree.root.traverse(include_text=True):
+        if node.tag == '-text':
+            text = node.text_content.strip()
+            if text:
+                parts.append(text)
+    return '\n'.join(parts)
+
+
+TEXT_BACKENDS = {
+    'lxml': _text_lxml,
+    'selectolax': _text_selectolax,
+    'html.parser': _text_html_parser,
+}
+
+
+def resolve_backend(backend=None):
+    backend = backend or PARSER_BACKEND
+    if backend == 'auto' or backend not in available_backends():
+        return available_backends()[0]
+    return backend
+
+
+def html_to_text(html, backend=None):
+    # Equivalent of BeautifulSoup(html, 'html.parser').get_text(separator='\n', strip=True)
+    backend = resolve_backend(backend)
+    with metrics.timer('parse_seconds', backend=backend):
+        if backend == 'html.parser':
+            return _text_html_parser(html)
+        try:
+            return TEXT_BACKENDS[backend](html)
+        except Exception:
+            # Empty documents, XML encoding declarations in str input, etc.
+            return _text_html_parser(html)
+
+
+def extract_onion_links(html, base_url):
+    # Absolute http(s) .onion URLs linked from a page, in page order, without
+    # fragments or duplicates. Regex instead of a parse tree: runs on every
+    # crawled page and only needs attribute values.
+    links = []
+    seen = set()
+    candidates = [next(g for g in m.groups() if g is not None) for m in HREF_RE.finditer(html)]
+    # A URL at the end of a sentence shouldn't keep the full stop
+    candidates.extend(u.rstrip('.,;:!)') for u in ONION_URL_RE.findall(html))
+    for raw in candidates:
+        raw = html_lib.unescape(raw.strip())
+        if not raw or raw.startswith(('#', 'javascript:', 'mailto:', 'data:')):
+            continue
+        try:
+            url, _ = urldefrag(urljoin(base_url, raw))
+            parsed = urlparse(url)
+            host = parsed.hostname or ''
+        except ValueError:
+            continue
+        if parsed.scheme not in ('http', 'https') or not host.endswith('.onion'):
+            continue
+        if url not in seen:
+            seen.add(url)
+            links.append(url)
+    return links
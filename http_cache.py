@@ -0,0 +1,262 @@
+import codecs
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import metrics
+
+# Cache lives next to the other crawl artifacts
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+CACHE_FILE = os.path.join(TEST_FILES_DIR, 'http_cache.sqlite3')
+
+# Set NIGHTCRAWLER_HTTP_CACHE=0 to bypass the cache entirely
+CACHE_ENABLED = os.environ.get('NIGHTCRAWLER_HTTP_CACHE', '1') != '0'
+# Entries not refreshed for this long are dropped (seconds)
+DEFAULT_TTL = 7 * 24 * 3600
+# Total compressed body size kept on disk before LRU eviction
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Served straight from disk when younger than this; older entries are revalidated
+DEFAULT_MAX_AGE = 3600
+# Eviction runs once per this many stores
+EVICT_EVERY = 100
+
+# Bodies are streamed and cut off past these limits (NIGHTCRAWLER_MAX_BODY_BYTES overrides the size)
+MAX_BODY_BYTES = int(os.environ.get('NIGHTCRAWLER_MAX_BODY_BYTES', 5 * 1024 * 1024))
+MAX_BODY_SECONDS = 60          # total time to read one body, however slowly it trickles in
+CHUNK_SIZE = 64 * 1024
+# Anything else (images, archives, binaries) is dropped after the headers.
+# A missing Content-Type is let through: plenty of onion servers don't send one.
+TEXT_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+
+class FetchAborted(Exception):
+    # Raised when a body is refused or cut off; reason is 'content_type', 'too_large' or 'too_slow'
+    def __init__(self, url, reason, detail):
+        super().__init__(f"Aborted {url}: {reason} ({detail})")
+        self.url = url
+        self.reason = reason
+        self.detail = detail
+
+
+def iter_chunks(resp):
+    # Whatever has arrived, up to CHUNK_SIZE, so a trickling body still hits the
+    # deadline check. iter_content would block until a full chunk is in.
+    raw = getattr(resp, 'raw', None)
+    if raw is None or not hasattr(raw, 'read1'):
+        # urllib3 < 2 has no read1
+        yield from resp.iter_content(CHUNK_SIZE)
+        return
+    while True:
+        chunk = raw.read1(CHUNK_SIZE, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_body(resp, url, max_bytes=MAX_BODY_BYTES, max_seconds=MAX_BODY_SECONDS, content_types=TEXT_CONTENT_TYPES):
+    # Decode a stream=True response chunk by chunk, aborting as soon as it breaks a limit
+    try:
+        content_type = resp.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_types and content_type and content_type not in content_types:
+            raise FetchAborted(url, 'content_type', content_type)
+        length = resp.headers.get('Content-Length', '')
+        if length.isdigit() and int(length) > max_bytes:
+            raise FetchAborted(url, 'too_large', f"Content-Length {length} > {max_bytes}")
+        try:
+            decoder = codecs.getincrementaldecoder(resp.encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        deadline = time.monotonic() + max_seconds
+        parts = []
+        size = 0
+        # Both undo gzip, so the cap also applies to decompressed bytes
+        for chunk in iter_chunks(resp):
+            size += len(chunk)
+            if size > max_bytes:
+                raise FetchAborted(url, 'too_large', f"more than {max_bytes} bytes")
+            if time.monotonic() > deadline:
+                raise FetchAborted(url, 'too_slow', f"{size} bytes in {max_seconds}s")
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b'', final=True))
+        return ''.join(parts)
+    except FetchAborted as e:
+        metrics.inc('fetch_aborted_total', reason=e.reason)
+        # Closing drops the connection instead of draining the rest of the body
+        resp.close()
+        raise
+
+
+def fetch(session, url, stage=None, **kwargs):
+    # session.get with a bounded, streamed body; returns (response, text).
+    # stage: record the request in fetch_seconds{stage} (network fetches only)
+    if stage is None:
+        return _fetch(session, url, **kwargs)
+    with metrics.timer('fetch_seconds', stage=stage):
+        return _fetch(session, url, **kwargs)
+
+
+def _fetch(session, url, **kwargs):
+    kwargs['stream'] = True
+    resp = session.get(url, **kwargs)
+    # A CircuitPool response is reported (CAPTCHA check, latency) once the body is read
+    settle = getattr(resp, 'settle', None) or (lambda text, error=None: None)
+    if resp.status_code == 304:
+        resp.close()
+        settle('')
+        return resp, ''
+    try:
+        text = read_body(resp, url)
+    except FetchAborted:
+        settle('')  # Refused by our limits: nothing wrong with the circuit
+        raise
+    except Exception as e:
+        settle(None, e)
+        raise
+    settle(text)
+    return resp, text
+
+
+class CachedResponse:
+    # The subset of requests.Response the fetchers use
+    def __init__(self, url, status_code, text, headers=None, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.from_cache = from_cache
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"HTTP {self.status_code} for url: {self.url}")
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stores = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            ' url TEXT PRIMARY KEY, status INTEGER, body BLOB, etag TEXT, last_modified TEXT,'
+            ' content_type TEXT, fetched_at REAL, accessed_at REAL, size INTEGER)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self._db.commit()
+
+    def lookup(self, url):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT status, body, etag, last_modified, content_type, fetched_at FROM responses WHERE url = ?',
+                (url,),
+            ).fetchone()
+        if not row:
+            return None
+        status, body, etag, last_modified, content_type, fetched_at = row
+        return {
+            'status': status, 'text': zlib.decompress(body).decode('utf-8'), 'etag': etag,
+            'last_modified': last_modified, 'content_type': content_type, 'fetched_at': fetched_at,
+        }
+
+    def store(self, url, status, text, headers):
+        body = zlib.compress(text.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (url, status, body, headers.get('ETag'), headers.get('Last-Modified'),
+                 headers.get('Content-Type'), now, now, len(body)),
+            )
+            self._db.commit()
+            self._stores += 1
+            if self._stores % EVICT_EVERY == 0:
+                self._evict_locked()
+
+    def refresh(self, url, headers):
+        # A 304 confirms the body; keep any new validators the server sent
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'UPDATE responses SET fetched_at = ?, accessed_at = ?,'
+                ' etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?',
+                (now, now, headers.get('ETag'), headers.get('Last-Modified'), url),
+            )
+            self._db.commit()
+
+    def touch(self, url):
+        with self._lock:
+            self._db.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (time.time(), url))
+            self._db.commit()
+
+    def evict(self):
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        self._db.execute('DELETE FROM responses WHERE fetched_at < ?', (time.time() - self.ttl,))
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used entries until we are back under the cap
+            excess = total - self.max_bytes
+            freed = 0
+            victims = []
+            for url, size in self._db.execute('SELECT url, size FROM responses ORDER BY accessed_at'):
+                victims.append((url,))
+                freed += size
+                if freed >= excess:
+                    break
+            self._db.executemany('DELETE FROM responses WHERE url = ?', victims)
+        self._db.commit()
+
+    def get(self, session, url, max_age=DEFAULT_MAX_AGE, **kwargs):
+        # GET through the cache: fresh entries are served from disk, stale ones
+        # are revalidated with If-None-Match/If-Modified-Since (304 = reuse body).
+        entry = self.lookup(url)
+        if entry and max_age and time.time() - entry['fetched_at'] < max_age:
+            self.touch(url)
+            return CachedResponse(url, entry['status'], entry['text'], {'Content-Type': entry['content_type']}, True)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        resp, text = fetch(session, url, headers=headers, **kwargs)
+        if resp.status_code == 304 and entry:
+            self.refresh(url, resp.headers)
+            return CachedResponse(url, entry['status'], entry['text'], {'Content-Type': entry['content_type']}, True)
+        if resp.status_code == 200:
+            self.store(url, resp.status_code, text, resp.headers)
+        return CachedResponse(url, resp.status_code, text, resp.headers)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
+
+
+def cached_get(session, url, max_age=DEFAULT_MAX_AGE, **kwargs):
+    # Shared entry point for main_script, monitor and model fetches; pass
+    # stage='...' to time the requests that actually go out (not disk hits)
+    if not CACHE_ENABLED:
+        resp, text = fetch(session, url, **kwargs)
+        return CachedResponse(url, resp.status_code, text, resp.headers)
+    return get_cache().get(session, url, max_age=max_age, **kwargs)
@@ -0,0 +1,159 @@
+import concurrent.futures
+import json
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+# Client defaults
+DEFAULT_TIMEOUT = 120          # seconds per request (read timeout covers gaps between streamed tokens)
+DEFAULT_MAX_CONCURRENCY = 4    # chat calls in flight at once
+DEFAULT_RATE_LIMIT = 2.0       # request starts per second
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF = 1.0          # seconds, doubled per retry
+MAX_BACKOFF = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Prefixes of the error strings chat() returns instead of raising
+ERROR_PREFIXES = ('[HTTP ', '[Error] ', '[Parse error] ')
+STREAM_ERROR = '[Stream error]'
+
+
+def is_error_answer(answer):
+    return answer.startswith(ERROR_PREFIXES) or STREAM_ERROR in answer
+
+
+class RateLimiter:
+    # Spaces request starts at least 1/rate seconds apart across threads
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class LLMClient:
+    # Chat-completions client: one pooled keep-alive session, bounded fan-out,
+    # retries with backoff on 429/5xx and optional SSE token streaming.
+    # Errors come back as "[HTTP ...]"/"[Error] ..." strings, like ask_mistral_chat always did.
+    def __init__(self, api_url, model, api_key, timeout=DEFAULT_TIMEOUT, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 rate_limit=DEFAULT_RATE_LIMIT, max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.api_url = api_url
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(rate_limit)
+        self.session = requests.session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f"Bearer {api_key}"
+
+    def build_messages(self, question, context):
+        messages = []
+        if context:
+            # Add context as a system message if present
+            messages.append({"role": "system", "content": context})
+        messages.append({"role": "user", "content": question})
+        return messages
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(MAX_BACKOFF, float(retry_after))
+                except ValueError:
+                    pass
+        return min(MAX_BACKOFF, self.backoff * (2 ** attempt))
+
+    def _post(self, payload, stream):
+        # POST with retries; returns the final response or raises the last exception
+        last_exc = None
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            try:
+                # With stream=True this times the first byte, not the whole answer
+                with metrics.timer('llm_seconds', stream=stream):
+                    response = self.session.post(self.api_url, json=payload, timeout=self.timeout, stream=stream)
+            except requests.RequestException as e:
+                metrics.inc('llm_errors_total', error=type(e).__name__)
+                last_exc = e
+                if attempt < self.max_retries:
+                    time.sleep(self._retry_delay(attempt))
+                continue
+            metrics.inc('llm_responses_total', status=response.status_code)
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+        raise last_exc
+
+    def chat(self, question, context, stream=False, on_token=None):
+        payload = {"messages": self.build_messages(question, context), "model": self.model}
+        if stream:
+            payload["stream"] = True
+        try:
+            response = self._post(payload, stream)
+        except requests.RequestException as e:
+            return f"[Error] {e}"
+        if response.status_code != 200:
+            return f"[HTTP {response.status_code}] {response.text}"
+        if stream:
+            return self._read_stream(response, on_token)
+        try:
+            result = response.json()
+            # The response format: {"choices": [{"message": {"role": ..., "content": ...}}], ...}
+            return result["choices"][0]["message"]["content"]
+        except Exception as e:
+            return f"[Parse error] {e}"
+
+    def _read_stream(self, response, on_token):
+        # Server-sent events: "data: {json}" lines, terminated by "data: [DONE]".
+        # SSE is always UTF-8; requests would fall back to ISO-8859-1 without a charset.
+        parts = []
+        try:
+            for raw in response.iter_lines():
+                line = raw.decode('utf-8', errors='replace')
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                except Exception:
+                    continue
+                if delta:
+                    parts.append(delta)
+                    if on_token:
+                        on_token(delta)
+        except requests.RequestException as e:
+            parts.append(f"\n{STREAM_ERROR} {e}")
+        finally:
+            response.close()
+        return ''.join(parts)
+
+    def chat_many(self, question, contexts):
+        # One call per context, up to max_concurrency at once; answers keep input order
+        if len(contexts) <= 1:
+            return [self.chat(question, c) for c in contexts]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(lambda c: self.chat(question, c), contexts))
+
+    def close(self):
+        self.session.close()
@@ -2,68 +2,146 @@ import requests
 import json
 import logging
 import os
-from bs4 import BeautifulSoup
-from stem import Signal
+from html_text import make_soup, html_to_text, extract_onion_links
 from stem.control import Controller
 from stem.process import launch_tor_with_config
 import time
 from urllib.parse import urlparse, parse_qs
 import concurrent.futures
+import asyncio
+import functools
+import argparse
+import atexit
+import glob
+import multiprocessing
+import threading
+import tor_pool
+from tor_pool import CircuitPool, RotationManager
+from http_cache import cached_get, FetchAborted
+from page_store import PageStore, strip_content
+from mirrors import MirrorIndex, fold_mirrors
+from frontier import Frontier
+from work_queue import WorkQueue
+import metrics
 
 # Base directory relative to this script
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
 
-# Ensure the directory exists
-os.makedirs(TEST_FILES_DIR, exist_ok=True)
-
 # File paths
 KEYWORDS_FILE = os.path.join(TEST_FILES_DIR, 'keywords.txt')
 RESULTS_FILE = os.path.join(TEST_FILES_DIR, 'searched_links.json')
+# Page texts, compressed and de-duplicated; searched_links.json keeps only their hashes
+PAGE_STORE_DIR = os.path.join(TEST_FILES_DIR, 'page_store')
+PAGE_STORE_BATCH = 500
 LOG_FILE = os.path.join(TEST_FILES_DIR, 'main.log')
+# Streaming mode (--stream): one JSON result per line plus a resume checkpoint
+RESULTS_JSONL_FILE = os.path.join(TEST_FILES_DIR, 'searched_links.jsonl')
+CHECKPOINT_FILE = os.path.join(TEST_FILES_DIR, 'crawl_checkpoint.json')
+# Recursive mode (--recursive): every page fetched, one JSON object per line
+CRAWL_RESULTS_JSONL_FILE = os.path.join(TEST_FILES_DIR, 'crawled_pages.jsonl')
 # Additional log file for skips and reasons
 SKIP_LOG_FILE = os.path.join(TEST_FILES_DIR, 'skipped_links.log')
 
-# Ensure files exist
-open(KEYWORDS_FILE, 'a').close()
-open(RESULTS_FILE, 'a').close()
-open(LOG_FILE, 'a').close()
-open(SKIP_LOG_FILE, 'a').close() # Ensure skip log exists
+# Tor proxy settings
+PROXIES = {
+    'http':  'socks5h://127.0.0.1:9050',
+    'https': 'socks5h://127.0.0.1:9050'
+}
+# Tor control port (ControlPort in torrc), used for health-driven NEWNYM
+TOR_CONTROL_HOST = '127.0.0.1'
+TOR_CONTROL_PORT = 9051
 
-# Configure logging
-logging.basicConfig(filename=LOG_FILE, level=logging.ERROR, 
-                    format='%(asctime)s %(levelname)s:%(message)s')
+# Number of isolated Tor circuits fetches are spread across
+TOR_CIRCUITS = 8
 
-if os.path.getsize(KEYWORDS_FILE) == 0:  # Only write if empty
-    with open(KEYWORDS_FILE, 'w', encoding='utf-8') as f:
-        f.write("bitcoin market\n")
-        f.write("hacking forums\n")
-        f.write("dark web search\n")
+# Async crawl mode (--async): total fetches in flight and fetches per onion host
+ASYNC_GLOBAL_CONCURRENCY = 200
+ASYNC_PER_HOST_CONCURRENCY = 4
+MAX_RESULTS_PER_KEYWORD = 5
+# Candidates validated at once per keyword, so a full keyword stops early
+ASYNC_VALIDATIONS_PER_KEYWORD = 10
+# Near-duplicate pages (onion mirrors) within a keyword are kept as links on the
+# first copy. Once a cluster has this many mirrors, candidates whose title/heading
+# look like its own are skipped without fetching (0 = always fetch).
+MIRROR_SATURATION = int(os.environ.get('NIGHTCRAWLER_MIRROR_SATURATION', '0'))
 
+# Hedged link checks: the link and (for https) its http variant race on different
+# circuits, a backup try of the link starts on another circuit after HEDGE_DELAY
+# seconds when the first circuit is known to be slower than that (or as soon as
+# the first try fails), and the link gets LINK_DEADLINE seconds in total, counted
+# from when its first try starts running.
+# NIGHTCRAWLER_HEDGE=0 restores try, retry, then http fallback.
+HEDGED_FETCH = os.environ.get('NIGHTCRAWLER_HEDGE', '1') != '0'
+HEDGE_DELAY = 3.0
+LINK_DEADLINE = 15.0
+FETCH_TIMEOUT = 10
+HEDGE_TRIES_PER_LINK = 3       # primary, http variant and backup
+# Candidates validated at once per keyword (sync mode)
+VALIDATION_WORKERS = 5
 
+# Result pages followed per engine, and fused candidates validated per keyword
+SEARCH_PAGE_DEPTH = 2
+MAX_CANDIDATES_PER_KEYWORD = 30
+# Reciprocal-rank fusion constant: score = sum(1 / (RRF_K + rank)) over engines
+RRF_K = 60
 
-# Configure logging
-logging.basicConfig(filename=LOG_FILE, level=logging.ERROR, 
-                    format='%(asctime)s %(levelname)s:%(message)s')
+# Recursive crawl mode (--recursive): follow onion links found on fetched pages
+RECURSIVE_MAX_DEPTH = 2        # link hops away from a search result
+RECURSIVE_MAX_PAGES = 500      # pages fetched per run
+RECURSIVE_WORKERS = 16
+RECURSIVE_HOST_BUDGET = 50     # pages per onion host, across runs
+RECURSIVE_HOST_DELAY = 2.0     # seconds between fetches from the same host
+RECURSIVE_SAVE_EVERY = 200     # pages between saves of the visited filter
 
-# Tor proxy settings
-PROXIES = {
-    'http':  'socks5h://127.0.0.1:9050',
-    'https': 'socks5h://127.0.0.1:9050'
-}
+# Sharded mode (--workers N): N processes, each with its own Tor, sharing one work queue
+SHARD_DIR = os.path.join(TEST_FILES_DIR, 'shards')
+SHARD_SOCKS_BASE_PORT = 9250   # worker i gets SocksPort 9250+i...
+SHARD_CONTROL_BASE_PORT = 9350 # ...and ControlPort 9350+i
+TOR_CMD = os.environ.get('TOR_CMD', 'tor')
+TOR_LAUNCH_TIMEOUT = 300       # seconds for a worker's Tor to bootstrap
+SHARD_MAX_RESTARTS = 3         # crashed workers replaced per run
+
+# Engine registry. 'url' is the first result page; 'page_url' (optional) is
+# formatted with query= and page= for the following ones, page numbers
+# starting at first_page and growing by page_step.
+SEARCH_ENGINES = []
+PARSERS = {}
+
+def register_engine(name, url, parser, page_url=None, first_page=1, page_step=1, enabled=True):
+    SEARCH_ENGINES.append({
+        'name': name, 'url': url, 'parser': parser, 'page_url': page_url,
+        'first_page': first_page, 'page_step': page_step, 'enabled': enabled,
+    })
 
-SEARCH_ENGINES = [
-    {
-        'name': 'Ahmia',
-        'url': 'http://juhanurmihxlp77nkq76byazcldy2hlmovfu2epvl5ankdibsot4csyd.onion/search/?q={}',
-        'parser': 'parse_ahmia'
-    }
-]
+def search_parser(func):
+    # Parsers are looked up by name from the engine entry
+    PARSERS[func.__name__] = func
+    return func
 
+register_engine(
+    'Ahmia', 'http://juhanurmihxlp77nkq76byazcldy2hlmovfu2epvl5ankdibsot4csyd.onion/search/?q={}', 'parse_ahmia',
+    page_url='http://juhanurmihxlp77nkq76byazcldy2hlmovfu2epvl5ankdibsot4csyd.onion/search/?q={query}&page={page}',
+)
+register_engine(
+    'Torch', 'http://torchdeedp3i2jigzjdmfpn5ttjhthh5wbmda2rr3jvqjg5p77c54dqd.onion/search?query={}', 'parse_torch',
+    page_url='http://torchdeedp3i2jigzjdmfpn5ttjhthh5wbmda2rr3jvqjg5p77c54dqd.onion/search?query={query}&page={page}',
+    first_page=2,
+)
+register_engine(
+    'Haystack', 'http://haystak5njsmn2hqkewecpaxetahtwhsbsa64jom2k22z5afxhnpxfid.onion/?q={}', 'parse_haystack',
+    page_url='http://haystak5njsmn2hqkewecpaxetahtwhsbsa64jom2k22z5afxhnpxfid.onion/?q={query}&offset={page}',
+    first_page=20, page_step=20,
+)
+register_engine(
+    'DuckDuckGo', 'https://duckduckgogg42xjoc72x3sjasowoarfbgcmvfimaftt6twagswzczad.onion/html/?q={}', 'parse_duckduckgo',
+)
 
+
+@search_parser
 def parse_ahmia(html):
     from urllib.parse import urlparse, parse_qs
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
     results = []
     for res in soup.select('li.result'):
         a = res.select_one('h4 > a')
@@ -75,12 +153,11 @@ def parse_ahmia(html):
             link = qs.get('redirect_url', [''])[0]
         heading = res.select_one('p').get_text(strip=True) if res.select_one('p') else ''
         results.append({'title': title, 'heading': heading, 'link': link})
-        if len(results) >= 5:
-            break
     return results
 
+@search_parser
 def parse_torch(html):
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
     results = []
     for res in soup.select('div.wrap > div.web-result'):
         a = res.select_one('a')
@@ -90,8 +167,9 @@ def parse_torch(html):
         results.append({'title': title, 'heading': heading, 'link': link})
     return results
 
+@search_parser
 def parse_haystack(html):
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
     results = []
     for res in soup.select('div.result'):
         a = res.select_one('a')
@@ -101,8 +179,9 @@ def parse_haystack(html):
         results.append({'title': title, 'heading': heading, 'link': link})
     return results
 
+@search_parser
 def parse_duckduckgo(html):
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
     results = []
     for res in soup.select('a.result__a'):
         title = res.get_text(strip=True)
@@ -111,27 +190,92 @@ def parse_duckduckgo(html):
         results.append({'title': title, 'heading': heading, 'link': link})
     return results
 
-def search_engine(engine, keyword, session):
-    url = engine['url'].format(requests.utils.quote(keyword))
+def engine_page_url(engine, keyword, page=0):
+    # page 0 is the engine's first result page
+    query = requests.utils.quote(keyword)
+    if page == 0:
+        return engine['url'].format(query)
+    return engine['page_url'].format(query=query, page=engine['first_page'] + (page - 1) * engine['page_step'])
+
+def search_engine(engine, keyword, session, page=0):
+    url = engine_page_url(engine, keyword, page)
     print(f"Searching '{keyword}' on {engine['name']}... URL: {url}")
     try:
-        resp = session.get(url, timeout=30)
+        with metrics.timer('search_seconds', engine=engine['name']):
+            resp = session.get(url, timeout=30)
+        metrics.inc('http_responses_total', stage='search', status=resp.status_code, cached=False)
         resp.raise_for_status()
-        parser = globals()[engine['parser']]
+        parser = PARSERS[engine['parser']]
         results = parser(resp.text)
         for r in results:
             r['engine'] = engine['name']
+        metrics.inc('search_results_total', len(results), engine=engine['name'])
         print(f"  Found {len(results)} results on {engine['name']} for '{keyword}'.")
-        return results  # Already limited to 5 in parser
+        return results
     except Exception as e:
+        metrics.inc('search_errors_total', engine=engine['name'])
         logging.error(f"Error searching {engine['name']} for '{keyword}': {e}")
         print(f"  Error searching {engine['name']} for '{keyword}': {e}")
         return []
 
+def engine_pages(engine, depth=SEARCH_PAGE_DEPTH):
+    return range(depth if engine.get('page_url') else 1)
+
+def add_page(ranked, page_results, seen):
+    # Append one page of hits; False once a page brings nothing new (end of results)
+    new = [r for r in page_results if r.get('link') and r['link'] not in seen]
+    for r in new:
+        seen.add(r['link'])
+        ranked.append(r)
+    return bool(new)
+
+def search_engine_pages(engine, keyword, session, depth=SEARCH_PAGE_DEPTH):
+    # Follow result pagination until depth or an empty page
+    ranked, seen = [], set()
+    for page in engine_pages(engine, depth):
+        if not add_page(ranked, search_engine(engine, keyword, session, page), seen):
+            break
+    return ranked
+
+def normalize_link(link):
+    parsed = urlparse(link.strip())
+    path = parsed.path.rstrip('/')
+    return f"{(parsed.hostname or '').lower()}{path}{'?' + parsed.query if parsed.query else ''}"
+
+def fuse_results(ranked_lists, k=RRF_K, limit=MAX_CANDIDATES_PER_KEYWORD):
+    # Reciprocal-rank fusion: links ranked high by several engines come first.
+    # Duplicates collapse into the best-ranked hit, listing every engine that found it.
+    fused = {}
+    for ranked in ranked_lists:
+        for rank, r in enumerate(ranked):
+            if not r.get('link'):
+                continue
+            key = normalize_link(r['link'])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {'result': dict(r, engines=[]), 'score': 0.0, 'best': rank}
+            elif rank < entry['best']:
+                entry['result'].update({f: r[f] for f in ('title', 'heading', 'link', 'engine')})
+                entry['best'] = rank
+            entry['score'] += 1.0 / (k + rank + 1)
+            if r['engine'] not in entry['result']['engines']:
+                entry['result']['engines'].append(r['engine'])
+    ordered = sorted(fused.values(), key=lambda e: -e['score'])
+    return [e['result'] for e in ordered[:limit]]
+
+def search_all_engines(keyword, session, depth=SEARCH_PAGE_DEPTH):
+    # Query every enabled engine at once, then fuse their ranked lists
+    engines = [e for e in SEARCH_ENGINES if e['enabled']]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(engines))) as executor:
+        ranked_lists = list(executor.map(lambda e: search_engine_pages(e, keyword, session, depth), engines))
+    fused = fuse_results(ranked_lists)
+    print(f"  {len(fused)} candidate link(s) for '{keyword}' after fusing {len(engines)} engine(s).")
+    return fused
+
 def get_current_ip(session):
     try:
         r = session.get('http://check.torproject.org/', timeout=20)
-        soup = BeautifulSoup(r.text, 'html.parser')
+        soup = make_soup(r.text)
         ip_tag = soup.find('strong')
         if ip_tag:
             return ip_tag.text.strip()
@@ -140,6 +284,20 @@ def get_current_ip(session):
         print(f"Could not get current IP: {e}")
         return 'Error'
 
+def prepare_files():
+    # Data files and logging; done by the entry points, so importing this
+    # module (nightcrawler.py, benchmarks, shard workers) has no side effects
+    os.makedirs(TEST_FILES_DIR, exist_ok=True)
+    for path in (KEYWORDS_FILE, LOG_FILE, SKIP_LOG_FILE):
+        open(path, 'a').close()
+    logging.basicConfig(filename=LOG_FILE, level=logging.ERROR,
+                        format='%(asctime)s %(levelname)s:%(message)s')
+    if os.path.getsize(KEYWORDS_FILE) == 0:  # Only write if empty
+        with open(KEYWORDS_FILE, 'w', encoding='utf-8') as f:
+            f.write("bitcoin market\n")
+            f.write("hacking forums\n")
+            f.write("dark web search\n")
+
 def read_keywords():
     try:
         with open(KEYWORDS_FILE, 'r', encoding='utf-8') as f:
@@ -160,9 +318,44 @@ BROWSER_HEADERS = {
     'Accept-Language': 'en-US,en;q=0.5',
 }
 
+class BufferedWriter:
+    # Collects log lines in memory and appends them in batches, instead of
+    # opening the file once per message from every worker thread.
+    def __init__(self, path, max_lines=500, flush_interval=2.0):
+        self.path = path
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._lines = []
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def write(self, line):
+        with self._lock:
+            self._lines.append(line)
+            due = len(self._lines) >= self.max_lines or time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+            self._last_flush = time.monotonic()
+            if not lines:
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+
+    def truncate(self):
+        with self._lock:
+            self._lines = []
+            open(self.path, 'w').close()
+
+# Skip log lines are batched instead of reopening the file per message
+skip_log = BufferedWriter(SKIP_LOG_FILE)
+
 def log_skip(msg):
-    with open(SKIP_LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(msg + '\n')
+    skip_log.write(msg)
 
 def is_valid_onion_url(url):
     # Accept any URL containing .onion (with or without path/query)
@@ -181,134 +374,880 @@ def is_valid_content(text, title='', heading=''):
         return True
     return False
 
-def try_fetch_url(url, session, title='', heading='', max_retries=1):
-    last_exc = None
-    for attempt in range(max_retries+1):
-        try:
-            resp = session.get(url, headers=BROWSER_HEADERS, timeout=10)
-            status = resp.status_code
-            content = resp.text
-            log_msg = f"[{url}] HTTP {status} | First 200 chars: {content[:200].replace(chr(10),' ').replace(chr(13),' ')}"
-            print(f"      {log_msg}")
-            log_skip(log_msg)
-            if status == 200:
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(content, 'html.parser')
-                text = soup.get_text(separator='\n', strip=True)
-                if is_valid_content(text, title, heading):
-                    return True, text
-                else:
-                    log_skip(f"[SKIP] {url} - Content not valid after HTTP 200.")
+def fetch_attempt(url, session, title='', heading='', links=None, timeout=FETCH_TIMEOUT, circuit=None):
+    # One GET of url; returns (ok, text, retryable). circuit pins a CircuitPool circuit.
+    # links: optional list that onion links found on a valid page are added to
+    kwargs = {'circuit': circuit} if circuit is not None else {}
+    try:
+        resp = cached_get(session, url, stage='crawl', headers=BROWSER_HEADERS, timeout=timeout, **kwargs)
+        status = resp.status_code
+        metrics.inc('http_responses_total', stage='crawl', status=status, cached=resp.from_cache)
+        content = resp.text
+        log_msg = f"[{url}] HTTP {status} | First 200 chars: {content[:200].replace(chr(10),' ').replace(chr(13),' ')}"
+        print(f"      {log_msg}")
+        log_skip(log_msg)
+        if status == 200:
+            text = html_to_text(content)
+            if is_valid_content(text, title, heading):
+                if links is not None:
+                    links.extend(extract_onion_links(content, url))
+                return True, text, False
             else:
-                log_skip(f"[SKIP] {url} - HTTP status {status}.")
-        except Exception as e:
-            last_exc = e
-            log_skip(f"[EXCEPTION] {url} - {e}")
+                log_skip(f"[SKIP] {url} - Content not valid after HTTP 200.")
+        else:
+            log_skip(f"[SKIP] {url} - HTTP status {status}.")
+    except FetchAborted as e:
+        # Junk or oversized body: retrying would only download it again
+        log_skip(f"[SKIP] {url} - {e.reason}: {e.detail}")
+        return False, None, False
+    except Exception as e:
+        metrics.inc('fetch_errors_total', stage='crawl', error=type(e).__name__)
+        log_skip(f"[EXCEPTION] {url} - {e}")
+    return False, None, True
+
+def try_fetch_url(url, session, title='', heading='', max_retries=1, links=None):
+    for attempt in range(max_retries+1):
+        ok, text, retryable = fetch_attempt(url, session, title, heading, links)
+        if ok:
+            return True, text
+        if not retryable:
+            break
     return False, None
 
-def is_working_onion_link(url, session, title='', heading=''):
+_hedge_executor = None
+_hedge_links = VALIDATION_WORKERS
+_hedge_lock = threading.Lock()
+# Per thread: list that hedged_fetch adds the tries it abandons to (see track_abandoned)
+_abandoned = threading.local()
+
+def hedge_executor():
+    global _hedge_executor
+    with _hedge_lock:
+        if _hedge_executor is None:
+            _hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_hedge_links * HEDGE_TRIES_PER_LINK, thread_name_prefix='hedged-fetch')
+        return _hedge_executor
+
+def size_hedge_pool(links):
+    # Room for every try of `links` links checked at once, so tries don't queue
+    # behind each other (threads are only started as needed)
+    global _hedge_executor, _hedge_links
+    with _hedge_lock:
+        if links <= _hedge_links:
+            return
+        _hedge_links = links
+        if _hedge_executor is not None:
+            # Tries already submitted still run; new ones go to a larger pool
+            _hedge_executor.shutdown(wait=False)
+            _hedge_executor = None
+
+def track_abandoned(func, *args):
+    # Returns (func's result, hedged tries it left running), so a caller
+    # limiting requests per host can count them until they finish
+    _abandoned.futures = []
+    try:
+        return func(*args), _abandoned.futures
+    finally:
+        _abandoned.futures = None
+
+def abandon(futures):
+    # Tries not started yet are cancelled; running ones finish on their own
+    running = [f for f in futures if not f.cancel()]
+    tracked = getattr(_abandoned, 'futures', None)
+    if tracked is not None:
+        tracked.extend(running)
+
+def hedged_fetch(url, session, title='', heading='', links=None, deadline=LINK_DEADLINE):
+    # Race the fetch variants of a link and take the first valid page; the
+    # losers are abandoned (their late results are dropped).
+    plan = [(url, 'primary')]
+    if url.startswith('https://'):
+        plan.append(('http://' + url[len('https://'):], 'http'))
+    circuits = session.spread(len(plan) + 1) if hasattr(session, 'spread') else [None] * (len(plan) + 1)
+    executor = hedge_executor()
+    # The deadline runs from when the first try starts, not from when it was queued
+    clock = {}
+    started = threading.Event()
+    clock_lock = threading.Lock()
+
+    def attempt(attempt_url, circuit):
+        now = time.monotonic()
+        with clock_lock:
+            start = clock.setdefault('start', now)
+        started.set()
+        remaining = deadline - (now - start)
+        if remaining <= 0:
+            return None  # Started past the deadline: not tried
+        found = [] if links is not None else None
+        ok, text, retryable = fetch_attempt(attempt_url, session, title, heading, found,
+                                            max(1.0, min(FETCH_TIMEOUT, remaining)), circuit)
+        return ok, text, retryable, found
+
+    def launch_backup():
+        pending[executor.submit(attempt, url, circuits[-1])] = (url, 'backup')
+
+    pending = {executor.submit(attempt, u, circuits[i]): (u, role) for i, (u, role) in enumerate(plan)}
+    # Only a circuit known to be slow is worth a second try of the same URL
+    hedge_at = HEDGE_DELAY if circuits[0] is not None and circuits[0].slow(HEDGE_DELAY) else None
+    backup = late = False
+    try:
+        started.wait()
+        start = clock['start']
+        while pending:
+            elapsed = time.monotonic() - start
+            if elapsed >= deadline:
+                break
+            wait = deadline - elapsed
+            if not backup and hedge_at is not None:
+                wait = min(wait, max(0.0, hedge_at - elapsed))
+            done, _ = concurrent.futures.wait(pending, timeout=wait, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                _, role = pending.pop(future)
+                result = future.result()
+                if result is None:
+                    late = True
+                    continue
+                ok, text, retryable, found = result
+                if ok:
+                    if links is not None:
+                        links.extend(found)
+                    metrics.inc('hedged_fetch_total', outcome=role)
+                    return True, text
+                # A failed first try is retried on another circuit right away
+                if role == 'primary' and retryable and not backup:
+                    launch_backup()
+                    backup = True
+            if not backup and hedge_at is not None and time.monotonic() - start >= hedge_at:
+                launch_backup()
+                backup = True
+        if pending or late:
+            log_skip(f"[DEADLINE] {url} - no valid response within {deadline:.0f}s.")
+            metrics.inc('hedged_fetch_total', outcome='deadline')
+        else:
+            metrics.inc('hedged_fetch_total', outcome='failed')
+        return False, None
+    finally:
+        abandon(pending)
+
+def is_working_onion_link(url, session, title='', heading='', links=None):
     # Accept any .onion URL
     if not url or not is_valid_onion_url(url):
         log_skip(f"[SKIP] {url} - Not a .onion link.")
         return False, None
+    if HEDGED_FETCH:
+        return hedged_fetch(url, session, title, heading, links)
     # Try as-is
-    ok, text = try_fetch_url(url, session, title, heading)
+    ok, text = try_fetch_url(url, session, title, heading, links=links)
     if ok:
         return True, text
     # If https, try http
     if url.startswith('https://'):
         http_url = 'http://' + url[len('https://'):]
         log_skip(f"[RETRY] {url} as {http_url}")
-        ok, text = try_fetch_url(http_url, session, title, heading)
+        ok, text = try_fetch_url(http_url, session, title, heading, links=links)
         if ok:
             return True, text
     return False, None
 
-def main():
+def check_result(r, keyword, session):
+    # Validate one search hit and attach keyword/content; None if unusable
+    link = r.get('link', '')
+    print(f"    - Checking link: {link}")
+    working, page_content = is_working_onion_link(link, session, r.get('title',''), r.get('heading',''))
+    if working and page_content:
+        r['keyword'] = keyword  # Add keyword field
+        r['content'] = page_content     # Store the page text
+        print(f"      [✓] Link is working and content is valid. Added.")
+        return r
+    print(f"      [✗] Link is not working or content not valid. Skipped.")
+    return None
+
+def skip_saturated_mirror(r, mirrors):
+    # True if r looks like one more copy of a cluster that has enough already
+    if not MIRROR_SATURATION:
+        return False
+    representative = mirrors.saturated(r, MIRROR_SATURATION)
+    if representative is None:
+        return False
+    log_skip(f"[MIRROR] {r.get('link', '')} - looks like another mirror of {representative}")
+    metrics.inc('mirrors_total', outcome='skipped')
+    return True
+
+def mark_mirror(r, mirrors):
+    # A near-duplicate of a page already kept for this keyword loses its text
+    # and only records which page it mirrors
+    representative = mirrors.add(r)
+    if representative is None:
+        return r
+    print(f"      [=] Mirror of {representative}; keeping the link only.")
+    metrics.inc('mirrors_total', outcome='folded')
+    mirror = {k: v for k, v in r.items() if k != 'content'}
+    mirror['mirror_of'] = representative
+    return mirror
+
+def connect_tor():
     # Assume Tor is already running externally
     print("\n==================== Connecting to Tor ====================")
-    controller = Controller.from_port(address='127.0.0.1', port=9051)
+    controller = Controller.from_port(address=TOR_CONTROL_HOST, port=TOR_CONTROL_PORT)
     controller.authenticate()
     print("[✓] Connected to Tor!")
+    # No NEWNYM here: every run's circuits use fresh SOCKS credentials, and
+    # RotationManager asks for a new identity only when the circuits degrade
+    return controller
 
-    # Request new identity at start
-    controller.signal(Signal.NEWNYM)
-    print("[✓] Requested new Tor identity (NEWNYM) at start.")
-    time.sleep(3)
+def write_results(all_results):
+    all_results = fold_mirrors(all_results)
+    print(f"\n==================== Writing Results ====================")
+    print(f"[i] Writing {len(all_results)} unique, working results with valid content to {RESULTS_FILE}...")
+    try:
+        store = PageStore(PAGE_STORE_DIR)
+        store.add(all_results)
+        store.close()
+        # Write-then-rename: an interrupted write never leaves a truncated file
+        with open(RESULTS_FILE + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump([strip_content(r) for r in all_results], f, indent=2, ensure_ascii=False)
+        os.replace(RESULTS_FILE + '.tmp', RESULTS_FILE)
+        print(f"[✓] Done writing results (page text in {PAGE_STORE_DIR}).")
+    except Exception as e:
+        logging.error(f"Error writing results: {e}")
+        print(f"[!] Error writing results: {e}")
+
+class CrawlCheckpoint:
+    # Streams each validated result to RESULTS_JSONL_FILE as soon as it is found
+    # and records finished keywords, so a restarted run resumes. Seen links are
+    # rebuilt from the JSONL on load.
+    def __init__(self, results_path=RESULTS_JSONL_FILE, checkpoint_path=CHECKPOINT_FILE):
+        self.results_path = results_path
+        self.checkpoint_path = checkpoint_path
+        self.completed_keywords = set()
+        self.seen_links = set()
+        self.keyword_counts = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        for path in (self.results_path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load(self):
+        if os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self.completed_keywords = set(state.get('completed_keywords', []))
+            except Exception as e:
+                logging.error(f"Error reading checkpoint: {e}")
+                print(f"[!] Ignoring unreadable checkpoint: {e}")
+        if os.path.exists(self.results_path):
+            # One line at a time: every saved result counts as seen
+            end = 0
+            with open(self.results_path, 'rb+') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Drop a line half-written by a crash so new appends stay valid
+                        f.truncate(end)
+                        break
+                    end += len(line)
+                    if line.strip():
+                        self._count(json.loads(line))
+        if self.completed_keywords or self.seen_links:
+            print(f"[i] Resuming: {len(self.completed_keywords)} keywords done, {len(self.seen_links)} links already saved.")
+
+    def append(self, r):
+        with self._lock:
+            with open(self.results_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(r, ensure_ascii=False) + '\n')
+            self._count(r)
 
-    keywords = read_keywords()
+    def _count(self, r):
+        self.seen_links.add(r['link'])
+        if 'mirror_of' not in r:
+            self.keyword_counts[r['keyword']] = self.keyword_counts.get(r['keyword'], 0) + 1
+
+    def complete(self, keyword):
+        with self._lock:
+            self.completed_keywords.add(keyword)
+            state = {'completed_keywords': sorted(self.completed_keywords)}
+            # Write-then-rename so a crash never leaves a torn checkpoint
+            tmp_path = self.checkpoint_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.checkpoint_path)
+
+    def mirror_links(self):
+        # (keyword, representative link) -> mirror links, from the streamed results
+        mirrors = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if '"mirror_of"' in line:
+                        r = json.loads(line)
+                        mirrors.setdefault((r['keyword'], r['mirror_of']), []).append(r['link'])
+        return mirrors
+
+    def export(self, path=RESULTS_FILE):
+        # Rebuild searched_links.json one line at a time, page texts going to the page store
+        print(f"\n==================== Writing Results ====================")
+        count = 0
+        try:
+            mirrors = self.mirror_links()
+            store = PageStore(PAGE_STORE_DIR)
+            batch = []
+            with open(path + '.tmp', 'w', encoding='utf-8') as out:
+                out.write('[')
+                if os.path.exists(self.results_path):
+                    with open(self.results_path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            if not line.strip():
+                                continue
+                            r = json.loads(line)
+                            if 'mirror_of' in r:
+                                continue
+                            if (r['keyword'], r['link']) in mirrors:
+                                r['mirrors'] = mirrors[(r['keyword'], r['link'])]
+                            batch.append(r)
+                            if len(batch) >= PAGE_STORE_BATCH:
+                                store.add(batch)
+                                batch = []
+                            out.write(',\n' if count else '\n')
+                            out.write(json.dumps(strip_content(r), indent=2, ensure_ascii=False))
+                            count += 1
+                out.write('\n]\n')
+            store.add(batch)
+            store.close()
+            os.replace(path + '.tmp', path)
+            print(f"[✓] Wrote {count} streamed results to {path} (page text in {PAGE_STORE_DIR}).")
+        except Exception as e:
+            logging.error(f"Error writing results: {e}")
+            print(f"[!] Error writing results: {e}")
+
+def open_checkpoint(restart=False):
+    checkpoint = CrawlCheckpoint()
+    if restart:
+        checkpoint.reset()
+    checkpoint.load()
+    return checkpoint
+
+def export_metrics():
+    skip_log.flush()
+    try:
+        metrics.export()
+        print(f"[✓] Metrics written to {metrics.METRICS_PROM_FILE} and {metrics.METRICS_JSON_FILE}.")
+    except Exception as e:
+        logging.error(f"Error writing metrics: {e}")
+        print(f"[!] Error writing metrics: {e}")
+
+def close_tor(controller, session):
+    if session.rotation:
+        print(f"\n[i] New Tor identities requested during the run: {session.rotation.newnyms}")
+    print("\n==================== Checking IP at Exit ====================")
+    ip_exit = get_current_ip(session)
+    print(f"[✓] Current Tor IP at exit: {ip_exit}")
+
+    controller.close()
+    session.close()
+    print("[✓] Tor control connection closed.")
+    export_metrics()
+    print("\n==================== Script Complete ====================\n")
+
+def crawl_keyword(keyword, session, seen_links, saved=0, on_result=None, claim_link=None):
+    # Search one keyword and validate its fused hits, 5 at a time, until
+    # MAX_RESULTS_PER_KEYWORD (minus `saved`) are found. on_result(r) gets each
+    # result as it is found; claim_link(link) lets another process own a link.
+    print(f"\n--- Searching for: '{keyword}' ---")
+    keyword_results = []
+    found = 0
+    seen_title_heading = set()  # Reset for each keyword
+    mirrors = MirrorIndex()
+    results = search_all_engines(keyword, session)
+    def process_result(r):
+        title_heading = (r['title'], r['heading'])
+        link = r.get('link', '')
+        if title_heading not in seen_title_heading and link and link not in seen_links:
+            if skip_saturated_mirror(r, mirrors):
+                return None
+            if claim_link and not claim_link(link):
+                return None
+            r = check_result(r, keyword, session)
+            if r:
+                seen_title_heading.add(title_heading)
+                seen_links.add(link)
+                return mark_mirror(r, mirrors)
+        return None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=VALIDATION_WORKERS) as executor:
+        future_to_result = {executor.submit(process_result, r): r for r in results}
+        for future in concurrent.futures.as_completed(future_to_result):
+            r = future.result()
+            if r:
+                if on_result:
+                    on_result(r)
+                keyword_results.append(r)
+                # Mirrors don't count toward the cap
+                found += 'mirror_of' not in r
+                if saved + found >= MAX_RESULTS_PER_KEYWORD:
+                    # Enough results: skip the candidates not started yet
+                    for pending in future_to_result:
+                        pending.cancel()
+                    break
+    return keyword_results
+
+def main(stream=False, restart=False, keywords=None):
+    prepare_files()
+    controller = connect_tor()
+
+    keywords = keywords or read_keywords()
     if not keywords:
         print("[!] No keywords found. Exiting.")
         controller.close()
         return
 
-    session = requests.session()
-    session.proxies = PROXIES
+    session = CircuitPool(TOR_CIRCUITS)
+    RotationManager(controller, session)
 
     print("\n==================== Checking IP at Start ====================")
     ip_start = get_current_ip(session)
     print(f"[✓] Current Tor IP at start: {ip_start}")
 
-    # Clear skip log at start
-    open(SKIP_LOG_FILE, 'w').close()
+    search_keywords(keywords, session, stream, restart)
+    close_tor(controller, session)
+
+def search_keywords(keywords, session, stream=False, restart=False):
+    # The crawl itself on a connected session; the daemon reuses its warm one
+    skip_log.truncate()
     all_results = []
     seen_links = set()
+    checkpoint = None
+    if stream:
+        checkpoint = open_checkpoint(restart)
+        seen_links = set(checkpoint.seen_links)
+        keywords = [k for k in keywords if k not in checkpoint.completed_keywords]
     print("\n==================== Starting Search ====================")
     for keyword in keywords:
-        print(f"\n--- Searching for: '{keyword}' ---")
-        keyword_results = []
-        seen_title_heading = set()  # Reset for each keyword
-        for engine in SEARCH_ENGINES:
-            print(f"  > Using search engine: {engine['name']}")
-            results = search_engine(engine, keyword, session)
-            def process_result(r):
-                title_heading = (r['title'], r['heading'])
-                link = r.get('link', '')
-                if title_heading not in seen_title_heading and link and link not in seen_links:
-                    print(f"    - Checking link: {link}")
-                    working, page_content = is_working_onion_link(link, session, r.get('title',''), r.get('heading',''))
-                    if working and page_content:
-                        seen_title_heading.add(title_heading)
-                        seen_links.add(link)
-                        r['keyword'] = keyword  # Add keyword field
-                        r['content'] = page_content     # Store the page text
-                        print(f"      [✓] Link is working and content is valid. Added.")
-                        return r
-                    else:
-                        print(f"      [✗] Link is not working or content not valid. Skipped.")
-                return None
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                future_to_result = {executor.submit(process_result, r): r for r in results}
-                for future in concurrent.futures.as_completed(future_to_result):
-                    r = future.result()
-                    if r:
-                        all_results.append(r)
-                        keyword_results.append(r)
-                        if len(keyword_results) >= 5:
-                            break
-            if len(keyword_results) >= 5:
+        # In stream mode, results saved before a restart count toward the cap
+        saved = checkpoint.keyword_counts.get(keyword, 0) if checkpoint else 0
+        on_result = checkpoint.append if checkpoint else all_results.append
+        crawl_keyword(keyword, session, seen_links, saved, on_result)
+        if checkpoint:
+            checkpoint.complete(keyword)
+    if checkpoint:
+        checkpoint.export()
+    else:
+        write_results(all_results)
+
+class CrawlLimiter:
+    # Global cap on requests in flight plus a smaller cap per onion host.
+    # Blocking requests calls run on the loop's executor under both caps.
+    def __init__(self, global_limit=ASYNC_GLOBAL_CONCURRENCY, per_host_limit=ASYNC_PER_HOST_CONCURRENCY):
+        self.global_sem = asyncio.Semaphore(global_limit)
+        self.per_host_limit = per_host_limit
+        self.host_sems = {}
+
+    def host_sem(self, url):
+        host = urlparse(url).hostname or ''
+        if host not in self.host_sems:
+            self.host_sems[host] = asyncio.Semaphore(self.per_host_limit)
+        return self.host_sems[host]
+
+    async def run(self, url, func, *args):
+        # Take the host slot first so waiting on a busy host never holds a global slot
+        loop = asyncio.get_running_loop()
+        async with self.host_sem(url):
+            async with self.global_sem:
+                result, leftovers = await loop.run_in_executor(None, functools.partial(track_abandoned, func, *args))
+            # Hedged tries abandoned by func still load the host: keep its slot until they end
+            if leftovers:
+                await asyncio.wait([asyncio.wrap_future(f) for f in leftovers])
+        return result
+
+async def crawl_keyword_async(keyword, session, limiter, seen_links, checkpoint=None):
+    keyword_results = []
+    mirror_results = []
+    saved = checkpoint.keyword_counts.get(keyword, 0) if checkpoint else 0
+    seen_title_heading = set()
+    mirrors = MirrorIndex()
+    slots = asyncio.Semaphore(ASYNC_VALIDATIONS_PER_KEYWORD)
+
+    async def validate(r):
+        async with slots:
+            await validate_one(r)
+
+    async def validate_one(r):
+        title_heading = (r['title'], r['heading'])
+        link = r.get('link', '')
+        # Claims happen on the loop thread, so no two tasks validate the same link
+        if saved + len(keyword_results) >= MAX_RESULTS_PER_KEYWORD:
+            return
+        if not link or title_heading in seen_title_heading or link in seen_links:
+            return
+        if skip_saturated_mirror(r, mirrors):
+            return
+        seen_title_heading.add(title_heading)
+        seen_links.add(link)
+        checked = await limiter.run(link, check_result, r, keyword, session)
+        if checked:
+            checked = mark_mirror(checked, mirrors)
+        if checked and 'mirror_of' in checked:
+            mirror_results.append(checked)
+            if checkpoint:
+                checkpoint.append(checked)
+        elif checked and saved + len(keyword_results) < MAX_RESULTS_PER_KEYWORD:
+            keyword_results.append(checked)
+            if checkpoint:
+                checkpoint.append(checked)
+        elif not checked:
+            # Release the claim so another engine's copy of this hit can be tried
+            seen_title_heading.discard(title_heading)
+            seen_links.discard(link)
+
+    async def search_pages(engine):
+        print(f"  > Using search engine: {engine['name']} for '{keyword}'")
+        ranked, seen = [], set()
+        for page in engine_pages(engine):
+            url = engine_page_url(engine, keyword, page)
+            page_results = await limiter.run(url, search_engine, engine, keyword, session, page)
+            if not add_page(ranked, page_results, seen):
                 break
-    print(f"\n==================== Writing Results ====================")
-    print(f"[i] Writing {len(all_results)} unique, working results with valid content to {RESULTS_FILE}...")
+        return ranked
+
+    engines = [e for e in SEARCH_ENGINES if e['enabled']]
+    ranked_lists = await asyncio.gather(*(search_pages(engine) for engine in engines))
+    await asyncio.gather(*(validate(r) for r in fuse_results(ranked_lists)))
+    if checkpoint:
+        # Already on disk; don't hold page text for the whole run
+        checkpoint.complete(keyword)
+        return []
+    return keyword_results + mirror_results
+
+async def crawl_async(keywords, session, limiter=None, checkpoint=None):
+    # Every keyword and engine runs as one pipeline; results keep keyword order
+    limiter = limiter or CrawlLimiter()
+    seen_links = set()
+    if checkpoint:
+        seen_links = set(checkpoint.seen_links)
+        keywords = [k for k in keywords if k not in checkpoint.completed_keywords]
+    per_keyword = await asyncio.gather(
+        *(crawl_keyword_async(keyword, session, limiter, seen_links, checkpoint) for keyword in keywords)
+    )
+    return [r for results in per_keyword for r in results]
+
+async def async_main(stream=False, restart=False, keywords=None):
+    prepare_files()
+    controller = connect_tor()
+
+    keywords = keywords or read_keywords()
+    if not keywords:
+        print("[!] No keywords found. Exiting.")
+        controller.close()
+        return
+
+    # Enough pooled connections per circuit for its share of concurrent requests
+    session = CircuitPool(TOR_CIRCUITS, pool_maxsize=ASYNC_GLOBAL_CONCURRENCY // TOR_CIRCUITS + 1)
+    RotationManager(controller, session)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=ASYNC_GLOBAL_CONCURRENCY))
+    size_hedge_pool(ASYNC_GLOBAL_CONCURRENCY)
+
+    print("\n==================== Checking IP at Start ====================")
+    ip_start = get_current_ip(session)
+    print(f"[✓] Current Tor IP at start: {ip_start}")
+
+    # Clear skip log at start
+    skip_log.truncate()
+    print(f"\n==================== Starting Async Search ({len(keywords)} keywords) ====================")
+    if stream:
+        checkpoint = open_checkpoint(restart)
+        await crawl_async(keywords, session, checkpoint=checkpoint)
+        checkpoint.export()
+    else:
+        all_results = await crawl_async(keywords, session)
+        write_results(all_results)
+    close_tor(controller, session)
+
+def crawl_page(item, session, frontier, max_depth=RECURSIVE_MAX_DEPTH):
+    # Fetch one frontier URL, queue the onion links it contains; result dict or None
+    url, depth, keyword = item
+    print(f"    - Crawling (depth {depth}): {url}")
+    links = [] if depth < max_depth else None
+    working, page_content = is_working_onion_link(url, session, links=links)
+    frontier.done(url)
+    metrics.inc('recursive_pages_total', outcome='ok' if working else 'failed')
+    if links:
+        queued = frontier.push_many(links, depth + 1, keyword=keyword, parent=url)
+        metrics.inc('recursive_links_queued_total', queued)
+        print(f"      [i] {len(links)} onion link(s) found, {queued} new.")
+    if not (working and page_content):
+        return None
+    # The first text line is normally the page <title>
+    title = page_content.split('\n', 1)[0][:200]
+    return {'title': title, 'heading': '', 'link': url, 'keyword': keyword, 'content': page_content,
+            'depth': depth}
+
+def crawl_recursive(session, frontier, writer, max_pages=RECURSIVE_MAX_PAGES, max_depth=RECURSIVE_MAX_DEPTH,
+                    workers=RECURSIVE_WORKERS):
+    # Pull leased URLs from the frontier until it is empty or max_pages were fetched.
+    # The frontier enforces per-host budgets and politeness, so an empty pop()
+    # with pending URLs just means every queued host is cooling down.
+    fetched = saved = 0
+    in_flight = {}
+    size_hedge_pool(workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while len(in_flight) < workers and fetched < max_pages:
+                item = frontier.pop()
+                if item is None:
+                    break
+                fetched += 1
+                in_flight[executor.submit(crawl_page, item, session, frontier, max_depth)] = item
+                if fetched % RECURSIVE_SAVE_EVERY == 0:
+                    frontier.save()
+            if not in_flight:
+                wait = frontier.next_ready() if fetched < max_pages else None
+                if wait is None:
+                    break
+                time.sleep(min(wait, 1.0))
+                continue
+            done, _ = concurrent.futures.wait(in_flight, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                in_flight.pop(future)
+                r = future.result()
+                if r:
+                    writer.write(json.dumps(r, ensure_ascii=False))
+                    saved += 1
+    frontier.save()
+    return fetched, saved
+
+def recursive_main(restart=False, keywords=None):
+    prepare_files()
+    controller = connect_tor()
+
+    keywords = keywords or read_keywords()
+    frontier = Frontier(host_budget=RECURSIVE_HOST_BUDGET, host_delay=RECURSIVE_HOST_DELAY)
+    if restart:
+        frontier.reset()
+        if os.path.exists(CRAWL_RESULTS_JSONL_FILE):
+            os.remove(CRAWL_RESULTS_JSONL_FILE)
+    pending = frontier.pending()
+    # Keywords only seed an empty frontier; a queued one resumes without them
+    if not pending and not keywords:
+        print("[!] No keywords found and nothing queued. Exiting.")
+        frontier.close()
+        controller.close()
+        return
+
+    session = CircuitPool(TOR_CIRCUITS, pool_maxsize=RECURSIVE_WORKERS // TOR_CIRCUITS + 1)
+    RotationManager(controller, session)
+
+    print("\n==================== Checking IP at Start ====================")
+    ip_start = get_current_ip(session)
+    print(f"[✓] Current Tor IP at start: {ip_start}")
+
+    skip_log.truncate()
+    if pending:
+        print(f"[i] Resuming: {pending} URL(s) queued from the previous run.")
+    else:
+        # Search hits are the depth-0 seeds
+        print("\n==================== Seeding Frontier ====================")
+        for keyword in keywords:
+            results = search_all_engines(keyword, session)
+            queued = sum(frontier.push(r['link'], 0, keyword=keyword) for r in results if r.get('link'))
+            print(f"  [i] {queued} new seed link(s) for '{keyword}'.")
+    print(f"\n==================== Recursive Crawl (depth {RECURSIVE_MAX_DEPTH}, "
+          f"max {RECURSIVE_MAX_PAGES} pages) ====================")
+    writer = BufferedWriter(CRAWL_RESULTS_JSONL_FILE, max_lines=50)
+    fetched, saved = crawl_recursive(session, frontier, writer, RECURSIVE_MAX_PAGES, RECURSIVE_MAX_DEPTH,
+                                     RECURSIVE_WORKERS)
+    writer.flush()
+    print(f"\n[✓] Crawled {fetched} page(s), {saved} with valid content; {frontier.pending()} URL(s) left queued.")
+    frontier.close()
+    # searched_links.json gets every crawled page, so model.py can use them
+    CrawlCheckpoint(results_path=CRAWL_RESULTS_JSONL_FILE).export(RESULTS_FILE)
+    close_tor(controller, session)
+
+def shard_path(index):
+    return os.path.join(SHARD_DIR, f"worker-{index}.jsonl")
+
+def shard_metrics_path(index):
+    # Per process, so a restarted worker doesn't overwrite its predecessor's
+    return os.path.join(SHARD_DIR, f"worker-{index}-{os.getpid()}.metrics.json")
+
+def merge_shard_metrics():
+    # Worker registries into this process's, for export_metrics()
+    paths = glob.glob(os.path.join(SHARD_DIR, 'worker-*.metrics.json'))
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                metrics.REGISTRY.merge(json.load(f))
+        except Exception as e:
+            logging.error(f"Error reading shard metrics {path}: {e}")
+    return len(paths)
+
+def launch_worker_tor(index):
+    # A private Tor per worker: own SocksPort, ControlPort and DataDirectory
+    socks_port = SHARD_SOCKS_BASE_PORT + index
+    control_port = SHARD_CONTROL_BASE_PORT + index
+    data_dir = os.path.join(SHARD_DIR, f"tor-{index}")
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"[shard {index}] Launching Tor (SocksPort {socks_port}, ControlPort {control_port})...")
+    process = launch_tor_with_config(
+        config={
+            'SocksPort': f"127.0.0.1:{socks_port} IsolateSOCKSAuth",
+            'ControlPort': f"127.0.0.1:{control_port}",
+            'CookieAuthentication': '1',
+            'DataDirectory': data_dir,
+        },
+        tor_cmd=TOR_CMD,
+        timeout=TOR_LAUNCH_TIMEOUT,
+        take_ownership=True,  # Tor exits with the worker
+        init_msg_handler=lambda line: print(f"[shard {index}] {line}") if 'Bootstrapped' in line else None,
+    )
+    print(f"[shard {index}] [✓] Tor is up.")
+    return socks_port, control_port, process
+
+def shard_worker(index, queue_path, socks_port=None):
+    # Worker process: pulls keywords from the shared queue and appends results to
+    # its own shard file. socks_port=None launches a private Tor for this worker.
+    prepare_files()
+    tor_process = controller = None
+    if socks_port is None:
+        socks_port, control_port, tor_process = launch_worker_tor(index)
+    queue = WorkQueue(queue_path)
+    session = CircuitPool(TOR_CIRCUITS, socks_ports=[socks_port])
+    if tor_process:
+        # Own Tor, so NEWNYM only affects this worker
+        controller = Controller.from_port(address=TOR_CONTROL_HOST, port=control_port)
+        controller.authenticate()
+        RotationManager(controller, session)
+    seen_links = set()
     try:
-        with open(RESULTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(all_results, f, indent=2, ensure_ascii=False)
-        print("[✓] Done writing results.")
-    except Exception as e:
-        logging.error(f"Error writing results: {e}")
-        print(f"[!] Error writing results: {e}")
+        with open(shard_path(index), 'a', encoding='utf-8') as shard:
+            def save(r):
+                shard.write(json.dumps(r, ensure_ascii=False) + '\n')
+                shard.flush()
+            while True:
+                keyword = queue.claim(index)
+                if keyword is None:
+                    break
+                try:
+                    crawl_keyword(keyword, session, seen_links, on_result=save,
+                                  claim_link=lambda link: queue.claim_link(link, keyword))
+                    queue.complete(keyword)
+                except Exception as e:
+                    logging.error(f"Shard {index} failed on '{keyword}': {e}")
+                    queue.fail(keyword, e)
+    finally:
+        session.close()
+        queue.close()
+        skip_log.flush()
+        try:
+            with open(shard_metrics_path(index), 'w', encoding='utf-8') as f:
+                json.dump(metrics.REGISTRY.dump(), f)
+        except Exception as e:
+            logging.error(f"Shard {index} could not write its metrics: {e}")
+        if controller:
+            controller.close()
+        if tor_process:
+            tor_process.kill()
+            tor_process.wait()
 
-    # Request new identity before exit
-    controller.signal(Signal.NEWNYM)
-    print("\n[✓] Requested new Tor identity (NEWNYM) before exit.")
-    time.sleep(3)
-    print("\n==================== Checking IP at Exit ====================")
-    ip_exit = get_current_ip(session)
-    print(f"[✓] Current Tor IP at exit: {ip_exit}")
+def merge_shards():
+    # All shard files, de-duplicated across workers and capped per keyword
+    merged = []
+    seen = set()
+    per_keyword = {}
+    for path in sorted(glob.glob(os.path.join(SHARD_DIR, 'worker-*.jsonl'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line of a killed worker
+                key = normalize_link(r['link'])
+                if key in seen:
+                    continue
+                if 'mirror_of' not in r:
+                    if per_keyword.get(r['keyword'], 0) >= MAX_RESULTS_PER_KEYWORD:
+                        continue
+                    per_keyword[r['keyword']] = per_keyword.get(r['keyword'], 0) + 1
+                seen.add(key)
+                merged.append(r)
+    return merged
 
-    controller.close()
-    print("[✓] Tor control connection closed.")
-    print("\n==================== Script Complete ====================\n")
+def sharded_main(workers, restart=False, shared_tor=False, keywords=None):
+    prepare_files()
+    keywords = keywords or read_keywords()
+    if not keywords:
+        print("[!] No keywords found. Exiting.")
+        return
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    queue = WorkQueue()
+    if restart:
+        queue.reset()
+        for path in glob.glob(os.path.join(SHARD_DIR, 'worker-*.jsonl')):
+            os.remove(path)
+    # No worker is running yet, so every lease is from an interrupted run
+    resumed = queue.requeue()
+    added = queue.add(keywords)
+    print(f"[i] {added} new keyword(s) queued, {queue.pending()} pending ({resumed} resumed).")
+    skip_log.truncate()
+    # Metrics cover this run only, resumed or not
+    for path in glob.glob(os.path.join(SHARD_DIR, 'worker-*.metrics.json')):
+        os.remove(path)
+    # shared_tor: every worker uses the already running Tor instead of its own
+    socks_port = tor_pool.TOR_SOCKS_PORT if shared_tor else None
+    ctx = multiprocessing.get_context('spawn')
+    def start(index):
+        proc = ctx.Process(target=shard_worker, args=(index, queue.path, socks_port), name=f"shard-{index}")
+        proc.start()
+        return proc
+    print(f"\n==================== Sharded Crawl ({workers} workers) ====================")
+    procs = {i: start(i) for i in range(workers)}
+    restarts = 0
+    while procs:
+        for index, proc in list(procs.items()):
+            proc.join(0.5)
+            if proc.is_alive():
+                continue
+            del procs[index]
+            if proc.exitcode != 0:
+                requeued = queue.requeue(index)
+                print(f"[!] Shard worker {index} exited with code {proc.exitcode}; {requeued} keyword(s) requeued.")
+                if restarts < SHARD_MAX_RESTARTS and queue.pending():
+                    restarts += 1
+                    procs[index] = start(index)
+    counts = queue.counts()
+    print(f"\n[✓] Keywords done: {counts.get('done', 0)}, failed: {counts.get('failed', 0)}, "
+          f"left: {counts.get('queued', 0) + counts.get('leased', 0)}.")
+    queue.close()
+    write_results(merge_shards())
+    merge_shard_metrics()
+    export_metrics()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Search dark web engines for keywords and validate .onion links.')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='run all keywords and engines as one asyncio pipeline')
+    parser.add_argument('--stream', action='store_true',
+                        help='append results to searched_links.jsonl as found and resume from the last checkpoint')
+    parser.add_argument('--recursive', action='store_true',
+                        help='follow onion links found on fetched pages (persistent frontier, resumable)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='split keywords across this many processes, each with its own Tor')
+    parser.add_argument('--shared-tor', action='store_true',
+                        help='with --workers, use the running Tor instead of launching one per worker')
+    parser.add_argument('--restart', action='store_true',
+                        help='with --stream, --recursive or --workers, discard the previous state and start over')
+    return parser.parse_args(argv)
+
+def run(args, keywords=None):
+    # Also the `search` subcommand of nightcrawler.py; keywords=None reads keywords.txt
+    if args.workers:
+        sharded_main(args.workers, args.restart, args.shared_tor, keywords)
+    elif args.recursive:
+        recursive_main(args.restart, keywords)
+    elif args.use_async:
+        asyncio.run(async_main(args.stream, args.restart, keywords))
+    else:
+        main(args.stream, args.restart, keywords)
 
 if __name__ == '__main__':
-    main()
+    run(parse_args())
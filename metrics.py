@@ -0,0 +1,230 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Exports land next to the other run artifacts
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+METRICS_PROM_FILE = os.path.join(TEST_FILES_DIR, 'metrics.prom')
+METRICS_JSON_FILE = os.path.join(TEST_FILES_DIR, 'metrics.json')
+
+METRIC_PREFIX = 'nightcrawler_'
+# Latency histogram bucket upper bounds, in seconds (Tor fetches are slow)
+LATENCY_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# Observations kept per histogram (reservoir sample) for exact-ish quantiles
+SAMPLE_SIZE = 2048
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(value)
+        else:
+            slot = random.randrange(self.count)
+            if slot < SAMPLE_SIZE:
+                self.samples[slot] = value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def merge(self, counts, count, total, samples):
+        # Fold in another histogram with the same buckets; the reservoir keeps
+        # samples from each side in proportion to its observation count
+        self.counts = [a + b for a, b in zip(self.counts, counts)]
+        if len(self.samples) + len(samples) > SAMPLE_SIZE:
+            own = round(SAMPLE_SIZE * self.count / (self.count + count)) if self.count + count else 0
+            own = max(SAMPLE_SIZE - len(samples), min(own, len(self.samples)))
+            self.samples = random.sample(self.samples, own) + random.sample(samples, SAMPLE_SIZE - own)
+        else:
+            self.samples = self.samples + list(samples)
+        self.count += count
+        self.total += total
+
+    def quantile(self, q):
+        if self.samples:
+            return weighted_quantile([(v, 1) for v in self.samples], q)
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+def weighted_quantile(pairs, q):
+    # pairs: (value, weight); value at which the cumulative weight reaches q
+    pairs = sorted(pairs)
+    total = sum(w for _, w in pairs)
+    if not total:
+        return None
+    seen = 0
+    for value, weight in pairs:
+        seen += weight
+        if seen >= q * total:
+            return value
+    return pairs[-1][0]
+
+
+class Metrics:
+    # Thread-safe counters and latency histograms keyed by name + labels
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(key), 'value': value}
+                for (name, key), value in sorted(self.counters.items())
+            ]
+            histograms = []
+            for (name, key), h in sorted(self.histograms.items()):
+                histograms.append({
+                    'name': name, 'labels': dict(key), 'count': h.count, 'sum': h.total,
+                    'mean': h.total / h.count if h.count else None,
+                    'p50': h.quantile(0.5), 'p90': h.quantile(0.9), 'p99': h.quantile(0.99),
+                })
+        return {'timestamp': time.time(), 'counters': counters, 'histograms': histograms}
+
+    def dump(self):
+        # Full state as JSON-able data, for merge() in another process
+        with self._lock:
+            return {
+                'counters': [[name, list(key), value] for (name, key), value in self.counters.items()],
+                'histograms': [[name, list(key), h.counts, h.count, h.total, h.samples]
+                               for (name, key), h in self.histograms.items()],
+            }
+
+    def merge(self, state):
+        # Add another registry's dump(), e.g. a worker process's
+        with self._lock:
+            for name, key, value in state['counters']:
+                key = (name, tuple(tuple(pair) for pair in key))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, key, counts, count, total, samples in state['histograms']:
+                key = (name, tuple(tuple(pair) for pair in key))
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].merge(counts, count, total, samples)
+
+    def summary(self, name, **labels):
+        # One histogram's worth of stats merged over every label set matching `labels`,
+        # e.g. summary('fetch_seconds', stage='crawl') across all hosts
+        wanted = set(_label_key(labels))
+        count, total, pairs = 0, 0.0, []
+        with self._lock:
+            for (hname, key), h in self.histograms.items():
+                if hname != name or not wanted.issubset(key):
+                    continue
+                count += h.count
+                total += h.total
+                # Each kept sample stands for count/len(samples) observations
+                weight = h.count / len(h.samples) if h.samples else 0
+                pairs.extend((v, weight) for v in h.samples)
+        if not count:
+            return {'count': 0, 'sum': 0.0, 'mean': None, 'p50': None, 'p90': None, 'p99': None}
+        return {'count': count, 'sum': total, 'mean': total / count, 'p50': weighted_quantile(pairs, 0.5),
+                'p90': weighted_quantile(pairs, 0.9), 'p99': weighted_quantile(pairs, 0.99)}
+
+    def counter_total(self, name, **labels):
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(v for (cname, key), v in self.counters.items() if cname == name and wanted.issubset(key))
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            typed = set()
+            for (name, key), value in sorted(self.counters.items()):
+                full = METRIC_PREFIX + name
+                if full not in typed:
+                    lines.append(f"# TYPE {full} counter")
+                    typed.add(full)
+                lines.append(f"{full}{_format_labels(key)} {value}")
+            for (name, key), h in sorted(self.histograms.items()):
+                full = METRIC_PREFIX + name
+                if full not in typed:
+                    lines.append(f"# TYPE {full} histogram")
+                    typed.add(full)
+                cumulative = 0
+                for bound, c in zip(list(h.buckets) + ['+Inf'], h.counts):
+                    cumulative += c
+                    lines.append(f"{full}_bucket{_format_labels(key, [('le', str(bound))])} {cumulative}")
+                lines.append(f"{full}_sum{_format_labels(key)} {h.total}")
+                lines.append(f"{full}_count{_format_labels(key)} {h.count}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, prom_path=METRICS_PROM_FILE, json_path=METRICS_JSON_FILE):
+        # Write-then-rename so scrapers never read a half-written file
+        for path, body in ((prom_path, self.prometheus_text()),
+                           (json_path, json.dumps(self.snapshot(), indent=2))):
+            if not path:
+                continue
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+
+# Process-wide registry used by main_script, monitor and html_text
+REGISTRY = Metrics()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+export = REGISTRY.export
@@ -0,0 +1,93 @@
+import threading
+from fingerprint import normalize, shingle_hashes, minhash, minhash_similarity, MINHASH_SIZE, MINHASH_EMPTY
+
+# Pages at least this similar (estimated Jaccard over word shingles) are mirrors
+MIRROR_SIMILARITY = 0.8
+# LSH banding: 16 bands of 4 signature values. Pages above ~0.5 similarity share
+# a band with high probability; only those candidates are compared in full.
+LSH_BANDS = 16
+# Search snippets (title + heading) this similar to one of a saturated cluster's
+# pages are taken for one more mirror
+SNIPPET_SIMILARITY = 0.8
+
+
+def snippet_words(r):
+    # Digits masked, so "Mirror 2" and "Mirror 3" read the same
+    return set(normalize(f"{r.get('title', '')} {r.get('heading', '')}").split())
+
+
+class MirrorIndex:
+    # MinHash-LSH index over validated page texts, grouping near-duplicates into
+    # clusters: the first page seen is the representative, later ones are
+    # recorded as its mirrors.
+    def __init__(self, threshold=MIRROR_SIMILARITY, bands=LSH_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = MINHASH_SIZE // bands
+        self.buckets = {}   # (band, band values) -> cluster ids
+        self.clusters = []  # {'link', 'signature', 'snippets', 'mirrors'}
+        self._lock = threading.Lock()
+
+    def _band_keys(self, signature):
+        keys = []
+        for band in range(self.bands):
+            values = tuple(signature[band * self.rows:(band + 1) * self.rows])
+            # A band with no shingles in it says nothing about similarity
+            if any(v != MINHASH_EMPTY for v in values):
+                keys.append((band, values))
+        return keys
+
+    def add(self, r):
+        # Returns the representative's link if r is a mirror of an earlier page,
+        # else None (r starts a new cluster)
+        signature = minhash(shingle_hashes(r.get('content') or ''))
+        keys = self._band_keys(signature)
+        with self._lock:
+            best, best_similarity = None, self.threshold
+            for cluster_id in {c for key in keys for c in self.buckets.get(key, ())}:
+                similarity = minhash_similarity(signature, self.clusters[cluster_id]['signature'])
+                if similarity >= best_similarity:
+                    best, best_similarity = cluster_id, similarity
+            if best is not None:
+                cluster = self.clusters[best]
+                cluster['mirrors'].append(r['link'])
+                cluster['snippets'].append(snippet_words(r))
+                return cluster['link']
+            cluster_id = len(self.clusters)
+            self.clusters.append({'link': r['link'], 'signature': signature, 'snippets': [snippet_words(r)],
+                                  'mirrors': []})
+            for key in keys:
+                self.buckets.setdefault(key, []).append(cluster_id)
+            return None
+
+    def saturated(self, r, saturation):
+        # Representative of a cluster that already has `saturation` mirrors and
+        # a page whose search snippet looks like r's, so r is probably one more
+        words = snippet_words(r)
+        if not words:
+            return None
+        with self._lock:
+            for cluster in self.clusters:
+                if len(cluster['mirrors']) < saturation:
+                    continue
+                for snippet in cluster['snippets']:
+                    if snippet and len(words & snippet) / len(words | snippet) >= SNIPPET_SIMILARITY:
+                        return cluster['link']
+        return None
+
+
+def fold_mirrors(results):
+    # Mirror entries (with 'mirror_of') become a 'mirrors' list on their representative
+    mirrors = {}
+    for r in results:
+        if r.get('mirror_of'):
+            mirrors.setdefault((r.get('keyword'), r['mirror_of']), []).append(r['link'])
+    if not mirrors:
+        return results
+    folded = []
+    for r in results:
+        if r.get('mirror_of'):
+            continue
+        links = mirrors.get((r.get('keyword'), r.get('link')))
+        folded.append(dict(r, mirrors=links) if links else r)
+    return folded
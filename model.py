@@ -1,14 +1,21 @@
 import os
 import json
-import requests
 from bs4 import BeautifulSoup
 import sys
 import time
+import re
+from collections import deque
+from http_cache import cached_get
+from retrieval import PassageIndex, tokenize
+from llm_client import LLMClient, is_error_answer
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from page_store import PageStore
 
 # File paths (reuse from main_script.py)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
 RESULTS_FILE = os.path.join(TEST_FILES_DIR, 'searched_links.json')
+PAGE_STORE_DIR = os.path.join(TEST_FILES_DIR, 'page_store')
 
 # Tor proxy settings (reuse from main_script.py)
 PROXIES = {
@@ -17,27 +24,70 @@ PROXIES = {
 }
 
 # Hugging Face API (updated for chat completions)
-HF_API_URL = "https://router.huggingface.co/v1/chat/completions"
+# HF_API_URL can point at a local stand-in for testing
+HF_API_URL = os.environ.get("HF_API_URL", "https://router.huggingface.co/v1/chat/completions")
 HF_MODEL = "mistralai/Mistral-7B-Instruct-v0.3:novita"
 HF_API_KEY = os.environ.get("HF_API_KEY")
 
+# LLM client: concurrent chunk calls and request starts per second
+LLM_MAX_CONCURRENCY = 4
+LLM_RATE_LIMIT = 2.0
+_llm_client = None
+_answer_cache = None
+_page_store = None
+
+# Retrieval: answer each question from the top-k BM25 passages in a single call.
+# Set NIGHTCRAWLER_RETRIEVAL=0 to send every chunk instead.
+USE_RETRIEVAL = os.environ.get('NIGHTCRAWLER_RETRIEVAL', '1') != '0'
+RETRIEVAL_TOP_K = 8
+
+# Chunking and map-reduce synthesis over chunks
+CHUNK_MAX_TOKENS = 12000
+CHUNK_OVERLAP_TOKENS = 200
+MAX_CALLS_PER_QUESTION = 12    # map + reduce calls, hard cap per question
+REDUCE_MAX_TOKENS = 12000      # partial answers merged in one reduce call
+NO_INFO = "NO RELEVANT INFORMATION"
+MAP_INSTRUCTION = ("Answer the question using only the excerpt in the system message. "
+                   f"If the excerpt does not help, reply exactly: {NO_INFO}\n\nQuestion: ")
+REDUCE_INSTRUCTION = ("The system message holds partial answers to the same question, each from a different "
+                      "excerpt. Merge them into one coherent, de-duplicated answer and point out any "
+                      "contradictions.\n\nQuestion: ")
+WORD_RE = re.compile(r'\S+')
+
 def get_hf_api_key():
     global HF_API_KEY
     if not HF_API_KEY:
         HF_API_KEY = input("Enter your Hugging Face API key: ").strip()
     return HF_API_KEY
 
-def load_results():
-    if not os.path.exists(RESULTS_FILE):
-        print(f"Results file not found: {RESULTS_FILE}")
-        sys.exit(1)
+def get_page_store():
+    global _page_store
+    if _page_store is None:
+        _page_store = PageStore(PAGE_STORE_DIR)
+    return _page_store
+
+def import_legacy_results(store):
+    # searched_links.json from before the page store carries the page text inline
     with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
         try:
             data = json.load(f)
         except Exception as e:
             print(f"Error loading results: {e}")
             sys.exit(1)
-    return data
+    legacy = [r for r in data if 'content' in r]
+    if legacy:
+        store.add(legacy)
+        print(f"[i] Imported {len(legacy)} result(s) from {RESULTS_FILE} into the page store.")
+
+def load_results():
+    # Metadata only: page texts stay compressed until a keyword is picked
+    store = get_page_store()
+    if not store.count() and os.path.exists(RESULTS_FILE) and os.path.getsize(RESULTS_FILE):
+        import_legacy_results(store)
+    if not store.count():
+        print(f"No results found in {PAGE_STORE_DIR} (run main_script.py first).")
+        sys.exit(1)
+    return store.metadata()
 
 def get_keywords_with_results(results):
     # Prefer grouping by 'keyword' if present
@@ -72,7 +122,7 @@ def get_links_for_keyword(results, keyword):
 
 def fetch_page(url, session):
     try:
-        resp = session.get(url, timeout=40)
+        resp = cached_get(session, url, timeout=40)
         resp.raise_for_status()
         return resp.text
     except Exception as e:
@@ -88,79 +138,239 @@ def fetch_all_pages(links):
         print(f"    Title: {r.get('title', '')}")
         if r.get('heading'):
             print(f"    Heading: {r.get('heading', '')}")
-        text = r.get('content', '')
+        if 'content' in r:
+            text = r['content']
+        else:
+            try:
+                text = get_page_store().get(r['content_hash'])
+            except KeyError:
+                print(f"    [!] Page text missing from the store.")
+                text = ''
         contents.append({'url': url, 'title': r.get('title', ''), 'heading': r.get('heading', ''), 'text': text})
     print("--------------------------------------------------------------")
     return contents
 
-def chunk_text(text, max_tokens=12000):
-    # Simple chunking by words (approximate, not exact tokens)
-    words = text.split()
-    chunk_size = max_tokens * 0.75  # conservative for tokens
-    chunk_size = int(chunk_size)
-    return [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
-
-def ask_mistral_chat(question, context, api_key):
-    headers = {"Authorization": f"Bearer {api_key}"}
-    messages = []
-    if context:
-        # Add context as a system message if present
-        messages.append({"role": "system", "content": context})
-    messages.append({"role": "user", "content": question})
-    payload = {
-        "messages": messages,
-        "model": HF_MODEL
-    }
-    response = requests.post(HF_API_URL, headers=headers, json=payload)
-    if response.status_code == 200:
-        try:
-            result = response.json()
-            # The response format: {"choices": [{"message": {"role": ..., "content": ...}}], ...}
-            return result["choices"][0]["message"]["content"]
-        except Exception as e:
-            return f"[Parse error] {e}"
-    else:
-        return f"[HTTP {response.status_code}] {response.text}"
+def estimate_tokens(word):
+    # ~4 characters per token for Mistral-style BPE on English/web text
+    return max(1, (len(word) + 3) // 4)
 
-def main():
-    api_key = get_hf_api_key()
-    results = load_results()
-    keywords = get_keywords_with_results(results)
-    if not keywords:
-        print("No keywords with results found.")
-        return
-    keyword = select_keyword(keywords)
+def iter_chunks(texts, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    # Streams chunks of at most max_tokens (estimated) over one or more texts,
+    # each starting with the last ~overlap_tokens of the previous one.
+    # Only the current window of words is held in memory.
+    if isinstance(texts, str):
+        texts = [texts]
+    window = deque()  # (word, tokens)
+    count = 0
+    fresh = False  # window has words not yet emitted
+    for text in texts:
+        for match in WORD_RE.finditer(text):
+            word = match.group()
+            tokens = estimate_tokens(word)
+            if count + tokens > max_tokens and window:
+                yield " ".join(w for w, _ in window)
+                fresh = False
+                while window and count > overlap_tokens:
+                    count -= window.popleft()[1]
+            window.append((word, tokens))
+            count += tokens
+            fresh = True
+    if fresh:
+        yield " ".join(w for w, _ in window)
+
+def chunk_text(text, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    return list(iter_chunks(text, max_tokens, overlap_tokens))
+
+def select_chunks(question, chunks, limit):
+    # Over budget: keep the chunks sharing the most question terms, in original order
+    if len(chunks) <= limit:
+        return chunks
+    terms = set(tokenize(question))
+    scored = sorted(range(len(chunks)), key=lambda i: -len(terms.intersection(tokenize(chunks[i]))))
+    return [chunks[i] for i in sorted(scored[:limit])]
+
+def group_partials(partials, max_tokens=REDUCE_MAX_TOKENS):
+    groups, current, count = [], [], 0
+    for p in partials:
+        tokens = sum(estimate_tokens(w) for w in p.split())
+        if current and count + tokens > max_tokens:
+            groups.append(current)
+            current, count = [], 0
+        current.append(p)
+        count += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def fit_partials(partials, max_tokens=REDUCE_MAX_TOKENS):
+    # Trim every partial answer to an equal share of one reduce call
+    share = max(1, max_tokens // len(partials))
+    fitted = []
+    for p in partials:
+        words, count = [], 0
+        for w in p.split():
+            count += estimate_tokens(w)
+            if count > share:
+                break
+            words.append(w)
+        fitted.append(" ".join(words))
+    return fitted
+
+def reduce_context(partials):
+    return "\n\n".join(f"[Partial answer {i+1}]\n{p.strip()}" for i, p in enumerate(partials))
+
+def build_retrieval_context(passages):
+    # Label each passage with its source so the model can cite it
+    return "\n\n".join(f"[Source: {p['link']}]\n{p['text']}" for p in passages)
+
+def get_llm_client(api_key):
+    # One pooled client per process so every call reuses the same TLS connection
+    global _llm_client
+    if _llm_client is None or _llm_client.api_key != api_key:
+        _llm_client = LLMClient(HF_API_URL, HF_MODEL, api_key,
+                                max_concurrency=LLM_MAX_CONCURRENCY, rate_limit=LLM_RATE_LIMIT)
+    return _llm_client
+
+def get_answer_cache(use_cache=True):
+    # Answers persist across sessions, keyed by question, context hash and HF_MODEL
+    global _answer_cache
+    if not (use_cache and ANSWER_CACHE_ENABLED):
+        return None
+    if _answer_cache is None:
+        _answer_cache = AnswerCache()
+    return _answer_cache
+
+def ask_mistral_chat(question, context, api_key, stream=False, on_token=None, use_cache=True):
+    cache = get_answer_cache(use_cache)
+    if cache:
+        cached = cache.get(question, context, HF_MODEL)
+        if cached is not None:
+            if on_token:
+                on_token(cached)
+            return cached
+    ans = get_llm_client(api_key).chat(question, context, stream=stream, on_token=on_token)
+    if cache and not is_error_answer(ans):
+        cache.put(question, context, HF_MODEL, ans)
+    return ans
+
+def ask_mistral_chat_many(question, contexts, api_key, use_cache=True):
+    # Fan the uncached chunks out concurrently; answers come back in chunk order
+    cache = get_answer_cache(use_cache)
+    answers = [cache.get(question, c, HF_MODEL) if cache else None for c in contexts]
+    missing = [i for i, ans in enumerate(answers) if ans is None]
+    fresh = get_llm_client(api_key).chat_many(question, [contexts[i] for i in missing])
+    for i, ans in zip(missing, fresh):
+        answers[i] = ans
+        if cache and not is_error_answer(ans):
+            cache.put(question, contexts[i], HF_MODEL, ans)
+    return answers
+
+def stream_answer(question, context, api_key, use_cache=True):
+    # Print the answer as tokens arrive; returns the full text
+    streamed = []
+    def print_token(token):
+        streamed.append(token)
+        print(token, end='', flush=True)
+    ans = ask_mistral_chat(question, context, api_key, stream=True, on_token=print_token, use_cache=use_cache)
+    if not streamed:
+        print(ans)  # Errors are returned, not streamed
+    return ans
+
+def map_reduce_answer(question, chunks, api_key, use_cache=True, max_calls=MAX_CALLS_PER_QUESTION):
+    # Map: ask each chunk in parallel. Reduce: merge the partial answers into one,
+    # hierarchically if they don't fit one call. Never more than max_calls calls.
+    if len(chunks) == 1:
+        return stream_answer(question, chunks[0], api_key, use_cache)
+    chunks = select_chunks(question, chunks, max_calls - 1)
+    answers = ask_mistral_chat_many(MAP_INSTRUCTION + question, chunks, api_key, use_cache=use_cache)
+    calls_left = max_calls - len(chunks)
+    partials = [a for a in answers if not is_error_answer(a) and NO_INFO not in a.upper()]
+    errors = [a for a in answers if is_error_answer(a)]
+    print(f"[i] {len(chunks)} chunk(s) asked, {len(partials)} relevant partial answer(s).")
+    if not partials:
+        msg = errors[0] if errors else "No relevant information found in the selected pages."
+        print(msg)
+        return msg
+    if len(partials) == 1:
+        print(partials[0].strip())
+        return partials[0]
+    groups = group_partials(partials)
+    # Intermediate reduce rounds, as long as a final call still fits the budget
+    while len(groups) > 1 and calls_left - len(groups) >= 1:
+        merged = ask_mistral_chat_many(REDUCE_INSTRUCTION + question, [reduce_context(g) for g in groups],
+                                       api_key, use_cache=use_cache)
+        calls_left -= len(groups)
+        groups = group_partials([m for m in merged if not is_error_answer(m)] or merged)
+    # Out of budget: every remaining partial is trimmed to fit the final call
+    final = groups[0] if len(groups) == 1 else fit_partials([p for g in groups for p in g])
+    return stream_answer(REDUCE_INSTRUCTION + question, reduce_context(final), api_key, use_cache)
+
+def open_index(results):
+    # BM25 index brought up to date with the page store; None with retrieval off
+    if not USE_RETRIEVAL:
+        return None
+    index = PassageIndex()
+    # Only new or changed pages are decompressed
+    indexed = index.update(results, get_page_store().get)
+    print(f"[✓] Retrieval index ready ({indexed} new or changed result(s) indexed).")
+    return index
+
+def load_context(results, keyword):
+    # Chunks of the keyword's page texts, or None if it has none
     links = get_links_for_keyword(results, keyword)
     if not links:
         print(f"No links found for keyword '{keyword}'.")
-        return
+        return None
     contents = fetch_all_pages(links)
     if not contents:
         print("No content fetched from landing pages.")
-        return
-    # Concatenate all content for context (only the actual content)
-    full_context = "\n\n".join(c['text'] for c in contents)
+        return None
     # Print the context for debugging
     print("\n--- DEBUG: Context being sent to the model (first 1000 chars) ---\n")
-    print(full_context[:1000])
+    print(contents[0]['text'][:1000])
     print("\n--- END DEBUG ---\n")
-    # Chunk if too long
-    context_chunks = chunk_text(full_context)
+    # Chunk straight from the page texts, without building one big string first
+    return list(iter_chunks(c['text'] for c in contents))
+
+def answer_question(question, keyword, context_chunks, index, api_key, use_cache=True):
+    if index is not None:
+        passages = index.search(question, keyword, RETRIEVAL_TOP_K)
+        if passages:
+            print("\n====================== Model Answer ==========================\n")
+            stream_answer(question, build_retrieval_context(passages), api_key, use_cache)
+            print("\n\nSources: " + ", ".join(sorted({p['link'] for p in passages})))
+            print("==============================================================\n")
+            return
+        print("[i] No passages match the question; asking over every chunk.")
+    print("\n====================== Model Answer ==========================\n")
+    map_reduce_answer(question, context_chunks, api_key, use_cache)
+    print("\n==============================================================\n")
+
+def main(keyword=None):
+    api_key = get_hf_api_key()
+    results = load_results()
+    index = open_index(results)
+    keywords = get_keywords_with_results(results)
+    if not keywords:
+        print("No keywords with results found.")
+        return
+    if keyword not in keywords:
+        keyword = select_keyword(keywords)
+    context_chunks = load_context(results, keyword)
+    if not context_chunks:
+        return
     print(f"\nFetched and prepared context. Entering Q&A mode. Type 'quit' to exit.")
+    if ANSWER_CACHE_ENABLED:
+        print("Repeated questions are answered from the cache; start a question with '!' to ask the model again.")
     print("==============================================================")
     while True:
         question = input("\nYour question (or 'quit'): ").strip()
         if question.lower() == 'quit':
             print("Exiting.")
             break
-        answers = []
-        for chunk_idx, chunk in enumerate(context_chunks):
-            ans = ask_mistral_chat(question, chunk, api_key)
-            answers.append(ans)
-        print("\n====================== Model Answer ==========================")
-        for idx, ans in enumerate(answers):
-            print(f"\n--- Chunk {idx+1} ---\n{ans.strip()}\n")
-        print("==============================================================\n")
+        use_cache = not question.startswith('!')
+        question = question.lstrip('!').strip()
+        answer_question(question, keyword, context_chunks, index, api_key, use_cache)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
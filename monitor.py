@@ -3,10 +3,16 @@ import time
 import json
 import hashlib
 import logging
-import requests
-from bs4 import BeautifulSoup
+import heapq
+import random
+import concurrent.futures
+from html_text import html_to_text
 from stem.control import Controller
-from stem import Signal
+from tor_pool import CircuitPool, RotationManager
+from http_cache import cached_get, FetchAborted
+import fingerprint
+from monitor_store import MonitorStore
+import metrics
 
 # Directories and files
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -15,21 +21,38 @@ MONITOR_LINKS_FILE = os.path.join(TEST_FILES_DIR, 'monitor_links.txt')
 HASHES_FILE = os.path.join(TEST_FILES_DIR, 'monitor_hashes.json')
 LOG_FILE = os.path.join(TEST_FILES_DIR, 'monitor.log')
 
-# Ensure files exist
-os.makedirs(TEST_FILES_DIR, exist_ok=True)
-open(MONITOR_LINKS_FILE, 'a').close()
-open(HASHES_FILE, 'a').close()
-open(LOG_FILE, 'a').close()
+# Isolated Tor circuits checks are spread across
+TOR_CIRCUITS = 4
 
-# Logging
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, 
-                    format='%(asctime)s %(levelname)s:%(message)s')
+# Scheduler: each link has its own next-check time; checks run on a bounded pool
+MONITOR_WORKERS = 16
+DEFAULT_INTERVAL = 3600        # seconds between checks for a new link
+MIN_INTERVAL = 300             # fastest a frequently changing page is polled
+MAX_INTERVAL = 24 * 3600       # slowest a static or dead page is polled
+CHANGE_SPEEDUP = 0.5           # interval multiplier after a change
+STABLE_SLOWDOWN = 1.5          # interval multiplier after an unchanged check
+FAILURE_BACKOFF = 2.0          # interval multiplier after a failed fetch
+INTERVAL_JITTER = 0.1          # spread checks so links don't fire in lockstep
+LINKS_RELOAD_INTERVAL = 60     # re-read monitor_links.txt this often
+METRICS_EXPORT_INTERVAL = 60   # write metrics.prom / metrics.json this often
+
+# Change detection: 'fingerprint' (SimHash + shingle sketch, ignores small noise)
+# or 'sha256' (any byte change alerts)
+CHANGE_DETECTION = os.environ.get('MONITOR_CHANGE_DETECTION', 'fingerprint')
+# Alert only when shingle similarity to the last version drops below this...
+SIMILARITY_THRESHOLD = 0.9
+# ...and at least this many lines were added or removed, so one rotating
+# line (a captcha or token the masking missed) on a short page stays quiet
+MIN_CHANGED_BLOCKS = 2
 
 # Tor proxy
 PROXIES = {
     'http':  'socks5h://127.0.0.1:9050',
     'https': 'socks5h://127.0.0.1:9050'
 }
+# Tor control port (ControlPort in torrc), used for health-driven NEWNYM
+TOR_CONTROL_HOST = '127.0.0.1'
+TOR_CONTROL_PORT = 9051
 
 BROWSER_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
@@ -40,17 +63,27 @@ BROWSER_HEADERS = {
 def is_valid_onion_url(url):
     return '.onion' in url
 
+def timed_fetch(url, session):
+    start = time.monotonic()
+    content = fetch_onion_content(url, session)
+    return content, time.monotonic() - start
+
 def fetch_onion_content(url, session):
     try:
-        resp = session.get(url, headers=BROWSER_HEADERS, timeout=30)
+        # max_age=0: always revalidate, an unchanged page costs only a 304
+        resp = cached_get(session, url, max_age=0, stage='monitor', headers=BROWSER_HEADERS, timeout=30)
+        metrics.inc('http_responses_total', stage='monitor', status=resp.status_code, cached=resp.from_cache)
         if resp.status_code == 200:
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            text = soup.get_text(separator='\n', strip=True)
+            text = html_to_text(resp.text)
             return text
         else:
             logging.warning(f"Non-200 status for {url}: {resp.status_code}")
             return None
+    except FetchAborted as e:
+        logging.warning(f"Skipped body of {url}: {e.reason} ({e.detail})")
+        return None
     except Exception as e:
+        metrics.inc('fetch_errors_total', stage='monitor', error=type(e).__name__)
         logging.error(f"Error fetching {url}: {e}")
         return None
 
@@ -66,55 +99,171 @@ def load_hashes():
         except Exception:
             return {}
 
-def save_hashes(hashes):
-    with open(HASHES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(hashes, f, indent=2)
+def open_store():
+    store = MonitorStore()
+    if store.is_empty():
+        # First run on the SQLite store: carry over monitor_hashes.json
+        hashes = load_hashes()
+        if hashes:
+            store.import_hashes(hashes)
+            print(f"[✓] Imported {len(hashes)} hashes from {HASHES_FILE}")
+    return store
 
-def notify_change(url):
+def notify_change(url, summary=None):
     msg = f"[CHANGE DETECTED] {url} has changed!"
+    if summary:
+        msg += (f" similarity={summary['similarity']:.2f} simhash={summary['simhash_similarity']:.2f}"
+                f" blocks +{summary['blocks_added']}/-{summary['blocks_removed']}")
     print(msg)
     logging.info(msg)
+    if summary:
+        for line in summary['added']:
+            print(f"    + {line}")
+            logging.info(f"  added: {line}")
 
 def read_monitor_links():
     with open(MONITOR_LINKS_FILE, 'r', encoding='utf-8') as f:
         return [line.strip() for line in f if line.strip() and is_valid_onion_url(line.strip())]
 
+def next_interval(interval, outcome):
+    # Adaptive polling: changing pages speed up, static or dead ones back off
+    if outcome == 'changed':
+        interval *= CHANGE_SPEEDUP
+    elif outcome == 'failed':
+        interval *= FAILURE_BACKOFF
+    elif outcome == 'unchanged':
+        interval *= STABLE_SLOWDOWN
+    return max(MIN_INTERVAL, min(MAX_INTERVAL, interval))
+
+def schedule_time(now, interval):
+    return now + interval * (1 + random.uniform(-INTERVAL_JITTER, INTERVAL_JITTER))
+
+def record_check(url, content, previous):
+    # Compare a fetched page against the stored hash/fingerprint.
+    # Returns (outcome, value to store); the value is None when the fetch failed.
+    if content is None:
+        print(f"  [!] Could not fetch content for {url}")
+        return 'failed', None
+    if CHANGE_DETECTION == 'fingerprint':
+        return record_fingerprint(url, content, previous)
+    content_hash = hash_content(content)
+    if previous is None:
+        print(f"  [+] First time monitoring {url}")
+        logging.info(f"First time monitoring {url}")
+        return 'new', content_hash
+    if isinstance(previous, dict):
+        previous = previous['sha256']
+    if previous != content_hash:
+        notify_change(url)
+        return 'changed', content_hash
+    print(f"  [=] No change for {url}")
+    return 'unchanged', content_hash
+
+def record_fingerprint(url, content, previous):
+    current = fingerprint.fingerprint(content)
+    if previous is None:
+        print(f"  [+] First time monitoring {url}")
+        logging.info(f"First time monitoring {url}")
+        return 'new', current
+    if isinstance(previous, str):
+        # Stored by sha256 mode: nothing to compare against, so re-baseline quietly
+        if previous == current['sha256']:
+            print(f"  [=] No change for {url}")
+            return 'unchanged', current
+        logging.info(f"Re-baselined {url} with a fingerprint")
+        return 'new', current
+    summary = fingerprint.compare(previous, current, content)
+    changed = max(summary['blocks_added'], summary['blocks_removed'])
+    if summary['similarity'] < SIMILARITY_THRESHOLD and changed >= MIN_CHANGED_BLOCKS:
+        notify_change(url, summary)
+        return 'changed', current
+    if summary['similarity'] < 1.0 or summary['blocks_added'] or summary['blocks_removed']:
+        print(f"  [~] Minor change for {url} (similarity {summary['similarity']:.2f}), below alert threshold")
+    else:
+        print(f"  [=] No change for {url}")
+    return 'unchanged', current
+
+def prepare_files():
+    # Data files and logging; done by main(), so importing this module has no side effects
+    os.makedirs(TEST_FILES_DIR, exist_ok=True)
+    open(MONITOR_LINKS_FILE, 'a').close()
+    open(LOG_FILE, 'a').close()
+    logging.basicConfig(filename=LOG_FILE, level=logging.INFO,
+                        format='%(asctime)s %(levelname)s:%(message)s')
+
 def main():
+    prepare_files()
     print("Connecting to Tor...")
-    controller = Controller.from_port(address='127.0.0.1', port=9051)
+    controller = Controller.from_port(address=TOR_CONTROL_HOST, port=TOR_CONTROL_PORT)
     controller.authenticate()
     print("[✓] Connected to Tor!")
-    session = requests.session()
-    session.proxies = PROXIES
-    print("Starting monitoring loop...")
+    session = CircuitPool(TOR_CIRCUITS)
+    # New identity only when the circuits degrade, never because a page changed
+    RotationManager(controller, session)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=MONITOR_WORKERS)
+    store = open_store()
+    links = set()
+    # Adapted intervals survive restarts
+    intervals = store.intervals()
+    queue = []  # (next_check_time, url)
+    # Time each link is due; heap entries that don't match are stale
+    scheduled = {}
+    in_flight = {}
+    next_reload = 0
+    next_export = time.time() + METRICS_EXPORT_INTERVAL
+    print("Starting monitoring scheduler...")
     while True:
-        links = read_monitor_links()
-        hashes = load_hashes()
-        changed = False
-        for url in links:
+        now = time.time()
+        if now >= next_export:
+            try:
+                metrics.export()
+            except Exception as e:
+                logging.error(f"Error writing metrics: {e}")
+            next_export = now + METRICS_EXPORT_INTERVAL
+        if now >= next_reload:
+            current = set(read_monitor_links())
+            checking = set(in_flight.values())
+            for url in current - links:
+                # New links are checked right away; one being checked is
+                # rescheduled when its check finishes
+                intervals.setdefault(url, DEFAULT_INTERVAL)
+                if url not in checking:
+                    scheduled[url] = now
+                    heapq.heappush(queue, (now, url))
+            for url in links - current:
+                intervals.pop(url, None)
+                scheduled.pop(url, None)
+            links = current
+            next_reload = now + LINKS_RELOAD_INTERVAL
+        # Dispatch everything that is due, up to the worker limit
+        while queue and queue[0][0] <= now and len(in_flight) < MONITOR_WORKERS:
+            due, url = heapq.heappop(queue)
+            if scheduled.get(url) != due:
+                continue  # Removed from monitor_links.txt, or rescheduled since
+            del scheduled[url]
             print(f"Checking {url} ...")
-            content = fetch_onion_content(url, session)
-            if content is None:
-                print(f"  [!] Could not fetch content for {url}")
+            in_flight[executor.submit(timed_fetch, url, session)] = url
+        wake = min(next_reload, next_export)
+        # With every worker busy, an overdue head would make this a busy loop:
+        # wait for a check to finish instead
+        if queue and len(in_flight) < MONITOR_WORKERS:
+            wake = min(wake, queue[0][0])
+        timeout = max(0.0, wake - time.time())
+        if not in_flight:
+            time.sleep(timeout)
+            continue
+        done, _ = concurrent.futures.wait(in_flight, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            url = in_flight.pop(future)
+            if url not in links:
                 continue
-            content_hash = hash_content(content)
-            if url in hashes:
-                if hashes[url] != content_hash:
-                    notify_change(url)
-                    changed = True
-                else:
-                    print(f"  [=] No change for {url}")
-            else:
-                print(f"  [+] First time monitoring {url}")
-                logging.info(f"First time monitoring {url}")
-            hashes[url] = content_hash
-        save_hashes(hashes)
-        if changed:
-            controller.signal(Signal.NEWNYM)
-            print("[✓] Requested new Tor identity (NEWNYM) after change.")
-            time.sleep(3)
-        print("Sleeping for 1 hour...")
-        time.sleep(3600)
+            content, latency = future.result()
+            outcome, current = record_check(url, content, store.fingerprint(url))
+            metrics.inc('monitor_checks_total', outcome=outcome)
+            intervals[url] = next_interval(intervals[url], outcome)
+            store.record(url, current, outcome, latency, intervals[url])
+            scheduled[url] = schedule_time(time.time(), intervals[url])
+            heapq.heappush(queue, (scheduled[url], url))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,117 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# State lives next to the other monitor files
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+STATE_FILE = os.path.join(TEST_FILES_DIR, 'monitor_state.sqlite3')
+
+# Checks kept per link in the history table
+HISTORY_LIMIT = 50
+
+
+class MonitorStore:
+    # Per-URL upserts into SQLite (WAL), so a check costs the same no matter how
+    # many links are monitored and a crash never leaves a half-written file.
+    def __init__(self, path=STATE_FILE, history_limit=HISTORY_LIMIT):
+        self.path = path
+        self.history_limit = history_limit
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS links ('
+            ' url TEXT PRIMARY KEY, fingerprint TEXT, status TEXT, latency REAL,'
+            ' checked_at REAL, changed_at REAL, interval REAL);'
+            'CREATE TABLE IF NOT EXISTS history ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, checked_at REAL,'
+            ' fingerprint TEXT, status TEXT, latency REAL);'
+            'CREATE INDEX IF NOT EXISTS history_url ON history (url, id);'
+            'CREATE INDEX IF NOT EXISTS history_checked ON history (checked_at);'
+        )
+        self._db.commit()
+
+    def is_empty(self):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM links LIMIT 1').fetchone() is None
+
+    def fingerprint(self, url):
+        # Last stored fingerprint: a dict (fingerprint mode) or a sha256 string
+        with self._lock:
+            row = self._db.execute('SELECT fingerprint FROM links WHERE url = ?', (url,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def intervals(self):
+        with self._lock:
+            return dict(self._db.execute('SELECT url, interval FROM links WHERE interval IS NOT NULL'))
+
+    def record(self, url, fingerprint, status, latency=None, interval=None, checked_at=None):
+        # Upsert the latest state and append one bounded history row
+        checked_at = checked_at or time.time()
+        stored = json.dumps(fingerprint) if fingerprint is not None else None
+        # History keeps only the compact part of a fingerprint
+        if isinstance(fingerprint, dict):
+            summary = json.dumps({'sha256': fingerprint.get('sha256'), 'simhash': fingerprint.get('simhash')})
+        else:
+            summary = stored
+        changed_at = checked_at if status == 'changed' else None
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO links (url, fingerprint, status, latency, checked_at, changed_at, interval)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)'
+                ' ON CONFLICT(url) DO UPDATE SET'
+                ' fingerprint = COALESCE(excluded.fingerprint, fingerprint), status = excluded.status,'
+                ' latency = excluded.latency, checked_at = excluded.checked_at,'
+                ' changed_at = COALESCE(excluded.changed_at, changed_at),'
+                ' interval = COALESCE(excluded.interval, interval)',
+                (url, stored, status, latency, checked_at, changed_at, interval),
+            )
+            self._db.execute(
+                'INSERT INTO history (url, checked_at, fingerprint, status, latency) VALUES (?, ?, ?, ?, ?)',
+                (url, checked_at, summary, status, latency),
+            )
+            self._db.execute(
+                'DELETE FROM history WHERE url = ? AND id <= ('
+                ' SELECT id FROM history WHERE url = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (url, url, self.history_limit),
+            )
+            self._db.commit()
+
+    def history(self, url, limit=None):
+        # Newest first: (checked_at, fingerprint summary, status, latency)
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT checked_at, fingerprint, status, latency FROM history WHERE url = ? ORDER BY id DESC LIMIT ?',
+                (url, limit or self.history_limit),
+            ).fetchall()
+        return [
+            {'checked_at': c, 'fingerprint': json.loads(f) if f else None, 'status': s, 'latency': l}
+            for c, f, s, l in rows
+        ]
+
+    def changed_since(self, since):
+        # Every change detected at or after `since` (epoch seconds), oldest first
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url, checked_at, latency FROM history WHERE status = 'changed' AND checked_at >= ?"
+                ' ORDER BY checked_at',
+                (since,),
+            ).fetchall()
+        return [{'url': u, 'changed_at': c, 'latency': l} for u, c, l in rows]
+
+    def import_hashes(self, hashes):
+        # One-time migration from monitor_hashes.json
+        now = time.time()
+        for url, value in hashes.items():
+            self.record(url, value, 'imported', checked_at=now)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
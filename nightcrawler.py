@@ -0,0 +1,380 @@
+import argparse
+import codecs
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# One entry point for search, monitor and ask. Only the stdlib is imported up
+# front: each subcommand imports the modules it needs (requests, bs4, stem,
+# the LLM client, ...), so --help and daemon clients start instantly.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+
+# Owner-only Unix socket the warm daemon takes jobs on
+DAEMON_SOCKET = os.environ.get('NIGHTCRAWLER_SOCKET', os.path.join(TEST_FILES_DIR, 'nightcrawler.sock'))
+# Keywords whose page chunks the daemon keeps in memory
+DAEMON_CONTEXT_CACHE = 8
+# Ends a daemon reply; the JSON job status follows it
+REPLY_END = '\0'
+
+
+class ReplyWriter:
+    # Stands in for stdout during a job: everything printed goes straight to
+    # the client. A client that hangs up doesn't stop the job.
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.hung_up = False
+        self._lock = threading.Lock()
+
+    def _send(self, text):
+        if self.hung_up:
+            return
+        try:
+            with self._lock:
+                self.wfile.write(text.encode('utf-8', 'replace'))
+        except OSError:
+            self.hung_up = True
+
+    def write(self, text):
+        self._send(text.replace(REPLY_END, ''))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def end(self, status):
+        self._send(REPLY_END + json.dumps(status) + '\n')
+
+
+class Daemon:
+    # Resident state shared by jobs: the Tor controller, the circuit pool with
+    # its keep-alive connections, the model's page store, LLM client and answer
+    # cache, the retrieval index and recently used keyword contexts
+    def __init__(self):
+        import main_script
+        import model
+        self.main_script = main_script
+        self.model = model
+        main_script.prepare_files()
+        self.controller = main_script.connect_tor()
+        self.session = main_script.CircuitPool(main_script.TOR_CIRCUITS)
+        main_script.RotationManager(self.controller, self.session)
+        self.results = None
+        self.index = None
+        self.contexts = OrderedDict()
+        self.jobs = 0
+        self.started = time.time()
+        self.server = None
+        self.stopping = False
+        # Jobs redirect the process-wide stdout, so they run one at a time
+        self._lock = threading.Lock()
+
+    def handle(self, job, out):
+        command = job.get('command')
+        if command == 'status':
+            return self.status()
+        if command == 'shutdown':
+            busy = self._lock.locked()
+            threading.Thread(target=self.stop, daemon=True).start()
+            return {'stopping': True, 'busy': busy}
+        handler = {'search': self.search, 'ask': self.ask}.get(command)
+        if handler is None:
+            return {'error': f"unknown command {command!r}"}
+        with self._lock:
+            if self.stopping:
+                return {'error': 'the daemon is shutting down'}
+            with contextlib.redirect_stdout(out):
+                try:
+                    status = handler(job)
+                except SystemExit:
+                    status = {'error': 'job exited early; see the output above'}
+                except Exception as e:
+                    logging.exception(f"Daemon {command} job failed")
+                    status = {'error': f"{type(e).__name__}: {e}"}
+                self.jobs += 1
+        return status
+
+    def drain(self):
+        # A running job finishes first (a search may be writing results);
+        # jobs still waiting are turned away
+        with self._lock:
+            self.stopping = True
+
+    def stop(self):
+        self.drain()
+        self.server.shutdown()
+
+    def search(self, job):
+        keywords = job.get('keywords') or self.main_script.read_keywords()
+        if not keywords:
+            return {'error': 'no keywords'}
+        self.main_script.search_keywords(keywords, self.session, job.get('stream', False), job.get('restart', False))
+        self.main_script.export_metrics()
+        # New pages: the next ask reloads results and contexts
+        self.results = None
+        self.contexts.clear()
+        return {'keywords': len(keywords)}
+
+    def load_results(self):
+        model = self.model
+        self.results = model.load_results()
+        if self.index is None:
+            self.index = model.open_index(self.results)
+        else:
+            indexed = self.index.update(self.results, model.get_page_store().get)
+            print(f"[✓] Retrieval index ready ({indexed} new or changed result(s) indexed).")
+
+    def context(self, keyword):
+        chunks = self.contexts.get(keyword)
+        if chunks is not None:
+            self.contexts.move_to_end(keyword)
+            return chunks
+        chunks = self.model.load_context(self.results, keyword)
+        if chunks:
+            self.contexts[keyword] = chunks
+            while len(self.contexts) > DAEMON_CONTEXT_CACHE:
+                self.contexts.popitem(last=False)
+        return chunks
+
+    def ask(self, job):
+        model = self.model
+        # No prompt for the key: the daemon has no terminal
+        if not model.HF_API_KEY:
+            return {'error': 'set HF_API_KEY in the environment of the daemon'}
+        keyword, question = job.get('keyword'), job.get('question', '').strip()
+        if not keyword or not question:
+            return {'error': 'ask needs a keyword and a question'}
+        if self.results is None:
+            self.load_results()
+        keywords = model.get_keywords_with_results(self.results)
+        if keyword not in keywords:
+            return {'error': f"no results for keyword {keyword!r} (have: {', '.join(sorted(keywords))})"}
+        chunks = self.context(keyword)
+        if not chunks:
+            return {'error': f"no page text for keyword {keyword!r}"}
+        model.answer_question(question, keyword, chunks, self.index, model.HF_API_KEY, job.get('use_cache', True))
+        return {}
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started),
+            'jobs': self.jobs,
+            'busy': self._lock.locked(),
+            'circuits': self.session.stats(),
+            'newnyms': self.session.rotation.newnyms if self.session.rotation else 0,
+            'contexts': list(self.contexts),
+        }
+
+    def close(self):
+        self.main_script.close_tor(self.controller, self.session)
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    # One job per connection: a JSON line in, the job's output and status out
+    def handle(self):
+        out = ReplyWriter(self.wfile)
+        try:
+            job = json.loads(self.rfile.readline() or b'{}')
+        except ValueError as e:
+            out.end({'error': f"bad request: {e}"})
+            return
+        out.end(self.server.daemon.handle(job, out))
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def daemon_running(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return True
+        except OSError:
+            return False
+
+
+def serve(path=DAEMON_SOCKET):
+    if os.path.exists(path):
+        if daemon_running(path):
+            print(f"[!] A daemon is already listening on {path}.")
+            return 1
+        os.remove(path)  # Left behind by a daemon that crashed
+    daemon = Daemon()
+    # Socket created owner-only: jobs run with this user's Tor and API key
+    umask = os.umask(0o177)
+    try:
+        server = DaemonServer(path, JobHandler)
+    finally:
+        os.umask(umask)
+    server.daemon = daemon
+    daemon.server = server
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=daemon.stop, daemon=True).start())
+    print(f"[✓] Daemon ready on {path} (pid {os.getpid()}). Stop it with: python nightcrawler.py daemon --stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+        if daemon.status()['busy']:
+            print("[i] Waiting for the running job to finish...")
+        daemon.drain()
+        daemon.close()
+    return 0
+
+
+def send_job(job, path=DAEMON_SOCKET):
+    # Prints the job's output as it arrives; returns an exit code
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            print(f"[!] No daemon listening on {path} (start one with: python nightcrawler.py daemon)")
+            return 1
+        sock.sendall((json.dumps(job) + '\n').encode('utf-8'))
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        status = None
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            if status is not None:
+                status += data
+                continue
+            head, end, tail = data.partition(REPLY_END.encode())
+            sys.stdout.write(decoder.decode(head))
+            sys.stdout.flush()
+            if end:
+                status = tail
+    if status is None:
+        print("\n[!] The daemon closed the connection before the job finished.")
+        return 1
+    status = json.loads(status or b'{}')
+    if status.get('error'):
+        print(f"[!] {status['error']}")
+        return 1
+    if job['command'] == 'status':
+        print(json.dumps(status, indent=2))
+    elif status.get('stopping'):
+        print(f"[✓] Daemon stopping{' after the running job' if status.get('busy') else ''}.")
+    return 0
+
+
+def cmd_search(args):
+    if args.daemon:
+        if args.use_async or args.recursive or args.workers:
+            print("[!] The daemon runs plain and --stream searches only.")
+            return 1
+        return send_job({'command': 'search', 'keywords': args.keywords, 'stream': args.stream,
+                         'restart': args.restart}, args.socket)
+    import main_script
+    main_script.run(args, args.keywords or None)
+
+
+def cmd_monitor(args):
+    import monitor
+    monitor.main()
+
+
+def cmd_ask(args):
+    question = ' '.join(args.question).strip()
+    if args.daemon:
+        return send_job({'command': 'ask', 'keyword': args.keyword, 'question': question,
+                         'use_cache': not args.no_cache}, args.socket)
+    import model
+    if not question:
+        model.main(args.keyword)
+        return
+    api_key = model.get_hf_api_key()
+    results = model.load_results()
+    keywords = model.get_keywords_with_results(results)
+    if args.keyword not in keywords:
+        print(f"[!] No results for keyword {args.keyword!r} (have: {', '.join(sorted(keywords))})")
+        return 1
+    index = model.open_index(results)
+    chunks = model.load_context(results, args.keyword)
+    if not chunks:
+        return 1
+    model.answer_question(question, args.keyword, chunks, index, api_key, not args.no_cache)
+
+
+def cmd_daemon(args):
+    if args.stop:
+        return send_job({'command': 'shutdown'}, args.socket)
+    if args.status:
+        return send_job({'command': 'status'}, args.socket)
+    return serve(args.socket)
+
+
+def add_daemon_arguments(parser):
+    parser.add_argument('--daemon', action='store_true', help='run the job in the running daemon')
+    parser.add_argument('--socket', default=DAEMON_SOCKET, help=f"daemon socket (default: {DAEMON_SOCKET})")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='nightcrawler',
+                                     description='Dark web keyword search, change monitoring and Q&A.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # Same options as main_script.py, declared here so the parser needs no imports
+    search = commands.add_parser('search', help='search engines for keywords and validate .onion links')
+    search.add_argument('keywords', nargs='*', help='keywords to search (default: test_files/keywords.txt)')
+    search.add_argument('--async', dest='use_async', action='store_true',
+                        help='run all keywords and engines as one asyncio pipeline')
+    search.add_argument('--stream', action='store_true',
+                        help='append results to searched_links.jsonl as found and resume from the last checkpoint')
+    search.add_argument('--recursive', action='store_true',
+                        help='follow onion links found on fetched pages (persistent frontier, resumable)')
+    search.add_argument('--workers', type=int, default=0,
+                        help='split keywords across this many processes, each with its own Tor')
+    search.add_argument('--shared-tor', action='store_true',
+                        help='with --workers, use the running Tor instead of launching one per worker')
+    search.add_argument('--restart', action='store_true',
+                        help='with --stream, --recursive or --workers, discard the previous state and start over')
+    add_daemon_arguments(search)
+    search.set_defaults(func=cmd_search)
+
+    monitor = commands.add_parser('monitor', help='check monitored .onion pages for changes')
+    monitor.set_defaults(func=cmd_monitor)
+
+    ask = commands.add_parser('ask', help='ask questions about the crawled pages of a keyword')
+    ask.add_argument('question', nargs='*', help='answer this one question and exit (default: interactive)')
+    ask.add_argument('--keyword', '-k', help='keyword whose pages to ask about (default: pick from a list)')
+    ask.add_argument('--no-cache', action='store_true', help='ask the model even if the answer is cached')
+    add_daemon_arguments(ask)
+    ask.set_defaults(func=cmd_ask)
+
+    daemon = commands.add_parser('daemon', help='keep Tor, connection pools, caches and indexes warm for jobs')
+    daemon.add_argument('--socket', default=DAEMON_SOCKET, help=f"socket to listen on (default: {DAEMON_SOCKET})")
+    daemon.add_argument('--stop', action='store_true', help='stop the running daemon')
+    daemon.add_argument('--status', action='store_true', help='show what the running daemon is doing')
+    daemon.set_defaults(func=cmd_daemon)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'ask' and args.daemon and not (args.keyword and args.question):
+        print("[!] With --daemon, ask needs --keyword and a question.")
+        return 1
+    if args.command == 'ask' and args.question and not args.keyword:
+        print("[!] A one-off question needs --keyword.")
+        return 1
+    return args.func(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+
+# Optional faster/denser codec, used when installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Cross-process writer lock on the pack file (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Store lives next to searched_links.json
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+STORE_DIR = os.path.join(TEST_FILES_DIR, 'page_store')
+INDEX_NAME = 'index.sqlite3'
+PACK_NAME = 'blobs.pack'
+
+# Compression: 'auto' (zstd if installed, else zlib), 'zstd' or 'zlib'
+STORE_CODEC = os.environ.get('NIGHTCRAWLER_STORE_CODEC', 'auto')
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+# Result fields kept as columns; anything else goes into the JSON `extra` column
+META_FIELDS = ('keyword', 'link', 'title', 'heading', 'engine')
+
+
+def content_hash(text):
+    # Same digest as retrieval.content_hash, so the index can skip unchanged pages
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def strip_content(r):
+    # Result as written to searched_links.json: the text is replaced by its hash
+    meta = {k: v for k, v in r.items() if k != 'content'}
+    meta['content_hash'] = content_hash(r.get('content') or '')
+    return meta
+
+
+def pick_codec(name=STORE_CODEC):
+    if name == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+    if name == 'zstd' and zstandard is None:
+        raise ValueError("NIGHTCRAWLER_STORE_CODEC=zstd needs the zstandard package")
+    return name
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError("page store blob is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PageStore:
+    # Crawl archive in two parts: a SQLite index of result metadata (one row per
+    # keyword/link, pointing at a content hash) and an append-only pack file of
+    # compressed page texts, each stored once per distinct content. Readers
+    # seek straight to the blobs they need, so listing keywords or loading one
+    # keyword's pages doesn't depend on the size of the archive.
+    def __init__(self, directory=STORE_DIR, codec=STORE_CODEC):
+        self.directory = directory
+        self.codec = pick_codec(codec)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, INDEX_NAME), check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            ' hash TEXT PRIMARY KEY, offset INTEGER, length INTEGER, size INTEGER, codec TEXT);'
+            'CREATE TABLE IF NOT EXISTS pages ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT, keyword TEXT, link TEXT, title TEXT, heading TEXT,'
+            ' engine TEXT, hash TEXT, extra TEXT, UNIQUE (keyword, link));'
+            'CREATE INDEX IF NOT EXISTS pages_keyword ON pages (keyword);'
+        )
+        self._db.commit()
+        self._pack = open(os.path.join(directory, PACK_NAME), 'a+b')
+        with self._lock, self._write_lock():
+            self._truncate_torn_tail()
+
+    @contextlib.contextmanager
+    def _write_lock(self):
+        # Held while appending and committing, and while repairing the tail, so
+        # one instance (or process) never cuts off blobs another is committing
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._pack.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._pack.fileno(), fcntl.LOCK_UN)
+
+    def _truncate_torn_tail(self):
+        # Blobs appended after the last index commit (crash) are unreachable; drop them.
+        # Without fcntl another writer can't be ruled out, so the tail is left alone.
+        if fcntl is None:
+            return
+        end = self._db.execute('SELECT MAX(offset + length) FROM blobs').fetchone()[0] or 0
+        self._pack.seek(0, os.SEEK_END)
+        if self._pack.tell() > end:
+            self._pack.truncate(end)
+
+    def _put_blob(self, text):
+        digest = content_hash(text)
+        if self._db.execute('SELECT 1 FROM blobs WHERE hash = ?', (digest,)).fetchone():
+            return digest
+        data = text.encode('utf-8')
+        packed = compress(data, self.codec)
+        self._pack.seek(0, os.SEEK_END)
+        offset = self._pack.tell()
+        self._pack.write(packed)
+        self._db.execute(
+            'INSERT INTO blobs (hash, offset, length, size, codec) VALUES (?, ?, ?, ?, ?)',
+            (digest, offset, len(packed), len(data), self.codec),
+        )
+        return digest
+
+    def add(self, results):
+        # Upsert results (keyword, link, ... and 'content'); returns how many were written
+        added = 0
+        with self._lock, self._write_lock():
+            for r in results:
+                digest = self._put_blob(r.get('content') or '')
+                extra = {k: v for k, v in r.items() if k not in META_FIELDS and k not in ('content', 'content_hash')}
+                self._db.execute(
+                    'INSERT INTO pages (keyword, link, title, heading, engine, hash, extra) VALUES (?, ?, ?, ?, ?, ?, ?)'
+                    ' ON CONFLICT(keyword, link) DO UPDATE SET title = excluded.title, heading = excluded.heading,'
+                    ' engine = excluded.engine, hash = excluded.hash, extra = excluded.extra',
+                    (r.get('keyword') or '', r.get('link', ''), r.get('title', ''), r.get('heading', ''),
+                     r.get('engine', ''), digest, json.dumps(extra, ensure_ascii=False) if extra else None),
+                )
+                added += 1
+            # Blobs must be on disk before the index points at them
+            self._pack.flush()
+            os.fsync(self._pack.fileno())
+            self._db.commit()
+        return added
+
+    def _rows(self, where='', args=()):
+        rows = self._db.execute(
+            'SELECT keyword, link, title, heading, engine, hash, extra FROM pages' + where + ' ORDER BY id', args
+        )
+        for keyword, link, title, heading, engine, digest, extra in rows:
+            r = {'keyword': keyword, 'link': link, 'title': title, 'heading': heading, 'engine': engine}
+            if not keyword:
+                del r['keyword']  # Legacy results grouped by title
+            if extra:
+                r.update(json.loads(extra))
+            r['content_hash'] = digest
+            yield r
+
+    def metadata(self):
+        # Every result without its text: cheap, only the index is read
+        with self._lock:
+            return list(self._rows())
+
+    def get(self, digest):
+        with self._lock:
+            row = self._db.execute('SELECT offset, length, codec FROM blobs WHERE hash = ?', (digest,)).fetchone()
+            if row is None:
+                raise KeyError(digest)
+            offset, length, codec = row
+            self._pack.seek(offset)
+            packed = self._pack.read(length)
+        return decompress(packed, codec).decode('utf-8')
+
+    def count(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            pages = self._db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            blobs, stored, raw = self._db.execute('SELECT COUNT(*), SUM(length), SUM(size) FROM blobs').fetchone()
+        return {'pages': pages, 'blobs': blobs, 'stored_bytes': stored or 0, 'raw_bytes': raw or 0}
+
+    def close(self):
+        with self._lock:
+            self._pack.close()
+            self._db.close()
@@ -0,0 +1,162 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+# Index lives next to searched_links.json
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+INDEX_FILE = os.path.join(TEST_FILES_DIR, 'retrieval_index.sqlite3')
+
+# Passage size and overlap in words
+PASSAGE_WORDS = 200
+PASSAGE_OVERLAP = 50
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r'\w+')
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have how i in is it its of on or that the this to was were what when '
+    'where which who why will with you your'.split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def split_passages(text, size=PASSAGE_WORDS, overlap=PASSAGE_OVERLAP):
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, size - overlap)
+    passages = []
+    for start in range(0, len(words), step):
+        passages.append(' '.join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return passages
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PassageIndex:
+    # BM25 inverted index over passages of crawl results, persisted in SQLite.
+    # update() only (re)indexes results whose content changed.
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS docs ('
+            ' id INTEGER PRIMARY KEY, keyword TEXT, link TEXT, title TEXT, hash TEXT, UNIQUE (keyword, link));'
+            'CREATE TABLE IF NOT EXISTS passages ('
+            ' id INTEGER PRIMARY KEY, doc_id INTEGER, position INTEGER, text TEXT, length INTEGER);'
+            'CREATE TABLE IF NOT EXISTS postings (term TEXT, passage_id INTEGER, tf INTEGER);'
+            'CREATE INDEX IF NOT EXISTS postings_term ON postings (term);'
+            'CREATE INDEX IF NOT EXISTS passages_doc ON passages (doc_id);'
+        )
+        self._db.commit()
+
+    def _remove_doc(self, doc_id):
+        self._db.execute(
+            'DELETE FROM postings WHERE passage_id IN (SELECT id FROM passages WHERE doc_id = ?)', (doc_id,)
+        )
+        self._db.execute('DELETE FROM passages WHERE doc_id = ?', (doc_id,))
+        self._db.execute('DELETE FROM docs WHERE id = ?', (doc_id,))
+
+    def update(self, results, load=None):
+        # Index new or changed results; returns how many were (re)indexed.
+        # Results may carry 'content_hash' instead of 'content', with load(hash)
+        # fetching the text only when the page has to be (re)indexed. Docs
+        # missing from results are dropped so the index mirrors the result set.
+        with self._lock:
+            known = {(k, l): (i, h) for i, k, l, h in self._db.execute('SELECT id, keyword, link, hash FROM docs')}
+            indexed = 0
+            seen = set()
+            for r in results:
+                key = (r.get('keyword') or r.get('title', ''), r.get('link', ''))
+                if key in seen:
+                    continue
+                seen.add(key)
+                if 'content' in r or load is None:
+                    text = r.get('content') or ''
+                    digest = content_hash(text)
+                else:
+                    text = None
+                    digest = r['content_hash']
+                if key in known:
+                    if known[key][1] == digest:
+                        continue
+                    self._remove_doc(known[key][0])
+                if text is None:
+                    text = load(digest)
+                cur = self._db.execute(
+                    'INSERT INTO docs (keyword, link, title, hash) VALUES (?, ?, ?, ?)',
+                    (key[0], key[1], r.get('title', ''), digest),
+                )
+                doc_id = cur.lastrowid
+                for position, passage in enumerate(split_passages(text)):
+                    terms = tokenize(passage)
+                    cur = self._db.execute(
+                        'INSERT INTO passages (doc_id, position, text, length) VALUES (?, ?, ?, ?)',
+                        (doc_id, position, passage, len(terms)),
+                    )
+                    self._db.executemany(
+                        'INSERT INTO postings (term, passage_id, tf) VALUES (?, ?, ?)',
+                        [(term, cur.lastrowid, tf) for term, tf in Counter(terms).items()],
+                    )
+                indexed += 1
+            for key in known.keys() - seen:
+                self._remove_doc(known[key][0])
+            self._db.commit()
+            return indexed
+
+    def search(self, query, keyword=None, k=8):
+        # Top-k passages by BM25, optionally limited to one keyword's results
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            where = ' WHERE d.keyword = ?' if keyword is not None else ''
+            args = (keyword,) if keyword is not None else ()
+            total, avg_len = self._db.execute(
+                'SELECT COUNT(*), AVG(p.length) FROM passages p JOIN docs d ON d.id = p.doc_id' + where, args
+            ).fetchone()
+            if not total:
+                return []
+            avg_len = avg_len or 1
+            scores = Counter()
+            for term in terms:
+                rows = self._db.execute(
+                    'SELECT po.passage_id, po.tf, p.length FROM postings po'
+                    ' JOIN passages p ON p.id = po.passage_id JOIN docs d ON d.id = p.doc_id'
+                    ' WHERE po.term = ?' + (' AND d.keyword = ?' if keyword is not None else ''),
+                    (term,) + args,
+                ).fetchall()
+                if not rows:
+                    continue
+                idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+                for passage_id, tf, length in rows:
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_len)
+                    scores[passage_id] += idf * tf * (BM25_K1 + 1) / norm
+            hits = []
+            for passage_id, score in scores.most_common(k):
+                link, title, text = self._db.execute(
+                    'SELECT d.link, d.title, p.text FROM passages p JOIN docs d ON d.id = p.doc_id WHERE p.id = ?',
+                    (passage_id,),
+                ).fetchone()
+                hits.append({'link': link, 'title': title, 'text': text, 'score': score})
+            return hits
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,331 @@
+import collections
+import functools
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from stem import Signal
+import metrics
+
+# Tor SOCKS endpoint (matches torrc)
+TOR_SOCKS_HOST = '127.0.0.1'
+TOR_SOCKS_PORT = 9050
+
+# Pool settings
+DEFAULT_CIRCUITS = 8
+DEFAULT_POOL_MAXSIZE = 10
+# A circuit is rotated after this many failures in a row...
+MAX_CONSECUTIVE_FAILURES = 3
+# ...or once its smoothed latency (seconds) goes above this
+SLOW_LATENCY = 20.0
+LATENCY_SMOOTHING = 0.3
+MIN_LATENCY_SAMPLES = 3
+# Statuses that mean "this exit/circuit is being throttled"
+RATE_LIMIT_STATUSES = (429, 503)
+# Challenge pages come back as 200s. In the first bytes of a body, a challenge
+# title or a captcha form/widget marks one; the bare word doesn't, since any
+# page (or search results for "captcha") may mention it.
+CAPTCHA_TITLE_RE = re.compile(
+    r'<title[^>]*>\s*(?:are you (?:a )?human|verify you are human|ddos protection|ddos-guard|just a moment'
+    r'|security check)[^<]{0,40}</title>', re.IGNORECASE)
+CAPTCHA_FORM_RE = re.compile(
+    r'''<input[^>]+name\s*=\s*["']?[\w-]*captcha|class\s*=\s*["'][^"']*\b(?:g-recaptcha|h-captcha|cf-turnstile)\b''',
+    re.IGNORECASE)
+CAPTCHA_SCAN_BYTES = 16384
+# Errors that mean the circuit is slow or broken. Tor answers a stream that
+# timed out with SOCKS "TTL expired"; refused connections and onion services
+# that can't be found are the site's fault and don't count either way.
+TIMEOUT_MARKERS = ('timed out', 'ttl expired')
+
+# Whole-identity rotation (NEWNYM) when the pool as a whole degrades: this
+# share of the last NEWNYM_WINDOW requests failed or was throttled...
+NEWNYM_FAILURE_RATIO = 0.5
+NEWNYM_WINDOW = 40
+# ...and the previous NEWNYM is at least this old (seconds)
+NEWNYM_MIN_INTERVAL = 60
+
+_pool_ids = itertools.count()
+
+
+class Circuit:
+    # One isolated Tor circuit: Tor's IsolateSOCKSAuth (on by default) puts
+    # streams with different SOCKS credentials on different circuits, so each
+    # Circuit gets unique credentials and its own keep-alive session.
+    def __init__(self, pool_id, index, socks_port=TOR_SOCKS_PORT, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        self.pool_id = pool_id
+        self.index = index
+        self.socks_port = socks_port
+        self.pool_maxsize = pool_maxsize
+        self.generation = 0
+        self.rotations = 0
+        self.session = self._new_session()
+        # Sessions of earlier generations still serving requests: generation -> [session, in_flight]
+        self.retired = {}
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.latency = None
+        self.samples = 0
+        self.failures = 0
+        self.in_flight = 0
+
+    def credentials(self):
+        # Changing the username is enough for Tor to build a fresh circuit
+        return f"nc{os.getpid()}-{self.pool_id}-{self.index}-{self.generation}", 'nightcrawler'
+
+    def proxies(self):
+        user, password = self.credentials()
+        proxy = f"socks5h://{user}:{password}@{TOR_SOCKS_HOST}:{self.socks_port}"
+        return {'http': proxy, 'https': proxy}
+
+    def _new_session(self):
+        session = requests.session()
+        session.proxies = self.proxies()
+        adapter = HTTPAdapter(pool_connections=self.pool_maxsize, pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def rotate(self):
+        # New credentials -> new circuit; in-flight requests finish on the old
+        # session, which is closed once the last of them is released
+        if self.in_flight:
+            self.retired[self.generation] = [self.session, self.in_flight]
+        else:
+            self.session.close()
+        self.generation += 1
+        self.rotations += 1
+        self.session = self._new_session()
+        self._reset_stats()
+
+    def finish(self, generation):
+        # A request started on `generation` is done; False if that was an old one
+        if generation == self.generation:
+            self.in_flight = max(0, self.in_flight - 1)
+            return True
+        retired = self.retired.get(generation)
+        if retired:
+            retired[1] -= 1
+            if retired[1] <= 0:
+                del self.retired[generation]
+                retired[0].close()
+        return False
+
+    def record(self, elapsed, ok):
+        self.samples += 1
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency = LATENCY_SMOOTHING * elapsed + (1 - LATENCY_SMOOTHING) * self.latency
+        self.failures = 0 if ok else self.failures + 1
+
+    def slow(self, threshold):
+        # Known (enough samples) to answer slower than threshold seconds
+        return self.samples >= MIN_LATENCY_SAMPLES and self.latency is not None and self.latency > threshold
+
+    def unhealthy(self):
+        return self.failures >= MAX_CONSECUTIVE_FAILURES or self.slow(SLOW_LATENCY)
+
+
+def is_circuit_failure(exc):
+    if isinstance(exc, (requests.exceptions.Timeout, urllib3.exceptions.TimeoutError, TimeoutError)):
+        return True
+    # requests wraps urllib3/PySocks errors, so look at the message too
+    text = str(exc).lower()
+    return any(marker in text for marker in TIMEOUT_MARKERS)
+
+
+def outcome_of(exc):
+    # ok value for a failed request: False counts against the circuit, None is neutral
+    return False if is_circuit_failure(exc) else None
+
+
+def is_captcha(resp, text=None):
+    # text: the decoded body of a streamed response (resp.text would re-read it)
+    if resp.headers.get('cf-mitigated') == 'challenge':
+        return True
+    head = (resp.text if text is None else text)[:CAPTCHA_SCAN_BYTES]
+    return bool(CAPTCHA_TITLE_RE.search(head) or CAPTCHA_FORM_RE.search(head))
+
+
+class CircuitPool:
+    # Drop-in for a requests session: get() picks the least busy circuit,
+    # records how it went and rotates only that circuit when it degrades.
+    def __init__(self, size=DEFAULT_CIRCUITS, socks_ports=None, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        ports = list(socks_ports or [TOR_SOCKS_PORT])
+        pool_id = next(_pool_ids)
+        self.circuits = [Circuit(pool_id, i, ports[i % len(ports)], pool_maxsize) for i in range(size)]
+        self.rotation = None  # RotationManager, if one is attached
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def acquire(self, exclude=None):
+        with self._lock:
+            # Round-robin start point so ties don't all land on circuit 0
+            order = self.circuits[self._next:] + self.circuits[:self._next]
+            self._next = (self._next + 1) % len(self.circuits)
+            candidates = [c for c in order if c is not exclude] or order
+            circuit = min(candidates, key=lambda c: c.in_flight)
+            circuit.in_flight += 1
+            return circuit, circuit.session, circuit.generation
+
+    def spread(self, n):
+        # n circuits for concurrent tries of the same URL, least busy first and
+        # distinct while the pool has enough of them
+        with self._lock:
+            ordered = sorted(self.circuits, key=lambda c: c.in_flight)
+        return [ordered[i % len(ordered)] for i in range(n)]
+
+    def release(self, circuit, generation, elapsed, ok):
+        # ok=None: the request failed for reasons unrelated to the circuit
+        with self._lock:
+            # Requests from before a rotation say nothing about the new circuit
+            if not circuit.finish(generation) or ok is None:
+                return
+            circuit.record(elapsed, ok)
+            if circuit.unhealthy():
+                logging.warning(f"Rotating Tor circuit {circuit.index} (failures={circuit.failures}, latency={circuit.latency})")
+                circuit.rotate()
+
+    def request(self, method, url, circuit=None, exclude=None, **kwargs):
+        if circuit is None:
+            circuit, session, generation = self.acquire(exclude)
+        else:
+            with self._lock:
+                circuit.in_flight += 1
+                session, generation = circuit.session, circuit.generation
+        start = time.monotonic()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except Exception as e:
+            self._report(circuit, generation, time.monotonic() - start, outcome_of(e))
+            raise
+        ok = resp.status_code not in RATE_LIMIT_STATUSES
+        if ok and kwargs.get('stream'):
+            # The body isn't read yet: the caller reports once it is (http_cache.fetch)
+            resp.settle = functools.partial(self._settle, resp, circuit, generation, start, [False])
+            return resp
+        if ok and is_captcha(resp):
+            metrics.inc('tor_captcha_total')
+            ok = False
+        self._report(circuit, generation, time.monotonic() - start, ok)
+        return resp
+
+    def _settle(self, resp, circuit, generation, start, settled, text, error=None):
+        # Report a streamed request once its body is in, or once reading it failed with `error`
+        if settled[0]:
+            return
+        settled[0] = True
+        ok = True if error is None else outcome_of(error)
+        if text and is_captcha(resp, text):
+            metrics.inc('tor_captcha_total')
+            ok = False
+        self._report(circuit, generation, time.monotonic() - start, ok)
+
+    def _report(self, circuit, generation, elapsed, ok):
+        self.release(circuit, generation, elapsed, ok)
+        if self.rotation and ok is not None:
+            self.rotation.record(ok)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def rotate(self, index):
+        with self._lock:
+            self.circuits[index].rotate()
+
+    def rotate_all(self):
+        with self._lock:
+            for c in self.circuits:
+                c.rotate()
+
+    def stats(self):
+        with self._lock:
+            return [
+                {'circuit': c.index, 'port': c.socks_port, 'in_flight': c.in_flight,
+                 'latency': c.latency, 'failures': c.failures, 'rotations': c.rotations}
+                for c in self.circuits
+            ]
+
+    def close(self):
+        for c in self.circuits:
+            c.session.close()
+            for session, _ in c.retired.values():
+                session.close()
+            c.retired.clear()
+
+
+class RotationManager:
+    # Sends NEWNYM through the Tor controller only when the pool as a whole
+    # degrades (single bad circuits are handled by CircuitPool). The signal is
+    # sent from a background thread once Tor's NEWNYM rate limit allows it, so
+    # requests keep flowing meanwhile; afterwards every circuit gets a new
+    # session and in-flight requests finish on the old ones.
+    def __init__(self, controller, pools=(), window=NEWNYM_WINDOW, failure_ratio=NEWNYM_FAILURE_RATIO,
+                 min_interval=NEWNYM_MIN_INTERVAL):
+        self.controller = controller
+        self.pools = []
+        self.failure_ratio = failure_ratio
+        self.min_interval = min_interval
+        self.recent = collections.deque(maxlen=window)
+        self.last_newnym = 0.0
+        self.newnyms = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        for pool in (pools if isinstance(pools, (list, tuple)) else [pools]):
+            self.attach(pool)
+
+    def attach(self, pool):
+        pool.rotation = self
+        self.pools.append(pool)
+        return pool
+
+    def record(self, ok):
+        with self._lock:
+            self.recent.append(ok)
+            if len(self.recent) < self.recent.maxlen or time.monotonic() - self.last_newnym < self.min_interval:
+                return
+            bad = self.recent.count(False) / len(self.recent)
+            if bad >= self.failure_ratio:
+                self._start(f"{bad:.0%} of the last {len(self.recent)} requests failed or were throttled")
+
+    def request(self, reason):
+        # Ask for a new identity now (still subject to Tor's rate limit)
+        with self._lock:
+            return self._start(reason)
+
+    def _start(self, reason):
+        if self._pending and self._pending.is_alive():
+            return False
+        self.recent.clear()
+        self._pending = threading.Thread(target=self._newnym, args=(reason,), name='tor-newnym', daemon=True)
+        self._pending.start()
+        return True
+
+    def _newnym(self, reason):
+        try:
+            while not self.controller.is_newnym_available():
+                time.sleep(max(0.1, self.controller.get_newnym_wait()))
+            self.controller.signal(Signal.NEWNYM)
+        except Exception as e:
+            logging.error(f"NEWNYM failed: {e}")
+            return
+        logging.warning(f"Requested new Tor identity (NEWNYM): {reason}")
+        metrics.inc('tor_newnym_total')
+        for pool in self.pools:
+            pool.rotate_all()
+        with self._lock:
+            self.recent.clear()
+            self.last_newnym = time.monotonic()
+            self.newnyms += 1
+
+    def wait(self, timeout=None):
+        # Block until a pending NEWNYM went out (tests, shutdown)
+        pending = self._pending
+        if pending:
+            pending.join(timeout)
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Queue lives next to the other crawl state
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_FILES_DIR = os.path.join(BASE_DIR, 'test_files')
+QUEUE_FILE = os.path.join(TEST_FILES_DIR, 'crawl_queue.sqlite3')
+
+# A task that failed this many times is parked as 'failed'
+MAX_ATTEMPTS = 3
+# Seconds a process waits for another one's write lock
+BUSY_TIMEOUT = 30
+
+
+class WorkQueue:
+    # Durable task queue shared by several processes through one SQLite file (WAL).
+    # Claims run in BEGIN IMMEDIATE transactions, so two workers never lease the
+    # same task. The links table lets workers claim result links, so a link is
+    # only validated by one worker per crawl.
+    def __init__(self, path=QUEUE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly where they matter
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, item TEXT UNIQUE, status TEXT DEFAULT 'queued',"
+            ' worker INTEGER, attempts INTEGER DEFAULT 0, error TEXT, updated_at REAL);'
+            'CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, id);'
+            'CREATE TABLE IF NOT EXISTS links (link TEXT PRIMARY KEY, item TEXT);'
+        )
+
+    def add(self, items):
+        # Queue new items; ones already known (in any state) are left alone
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            before = self._db.total_changes
+            self._db.executemany('INSERT OR IGNORE INTO tasks (item, updated_at) VALUES (?, ?)',
+                                 [(item, now) for item in items])
+            added = self._db.total_changes - before
+            self._db.execute('COMMIT')
+        return added
+
+    def claim(self, worker):
+        # Lease the oldest queued item to `worker`; None when nothing is left
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute("SELECT id, item FROM tasks WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row:
+                    self._db.execute(
+                        "UPDATE tasks SET status = 'leased', worker = ?, attempts = attempts + 1, updated_at = ?"
+                        ' WHERE id = ?',
+                        (worker, time.time(), row[0]),
+                    )
+            finally:
+                self._db.execute('COMMIT')
+        return row[1] if row else None
+
+    def complete(self, item):
+        with self._lock:
+            self._db.execute("UPDATE tasks SET status = 'done', error = NULL, updated_at = ? WHERE item = ?",
+                             (time.time(), item))
+
+    def fail(self, item, error, max_attempts=MAX_ATTEMPTS):
+        # Back in the queue for another try, or parked once out of attempts
+        with self._lock:
+            self._db.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,"
+                ' error = ?, worker = NULL, updated_at = ? WHERE item = ?',
+                (max_attempts, str(error)[:500], time.time(), item),
+            )
+
+    def requeue(self, worker=None):
+        # Leases held by a dead worker (or by anyone, on startup) go back in the queue
+        with self._lock:
+            if worker is None:
+                cur = self._db.execute("UPDATE tasks SET status = 'queued', worker = NULL WHERE status = 'leased'")
+            else:
+                cur = self._db.execute(
+                    "UPDATE tasks SET status = 'queued', worker = NULL WHERE status = 'leased' AND worker = ?", (worker,)
+                )
+            return cur.rowcount
+
+    def claim_link(self, link, item):
+        # True if this item may validate the link: nobody had it, or this item
+        # claimed it on an earlier (interrupted) attempt
+        with self._lock:
+            cur = self._db.execute('INSERT OR IGNORE INTO links (link, item) VALUES (?, ?)', (link, item))
+            if cur.rowcount:
+                return True
+            row = self._db.execute('SELECT item FROM links WHERE link = ?', (link,)).fetchone()
+        return row is not None and row[0] == item
+
+    def counts(self):
+        with self._lock:
+            return dict(self._db.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status'))
+
+    def pending(self):
+        counts = self.counts()
+        return counts.get('queued', 0) + counts.get('leased', 0)
+
+    def reset(self):
+        with self._lock:
+            self._db.execute('DELETE FROM tasks')
+            self._db.execute('DELETE FROM links')
+
+    def close(self):
+        with self._lock:
+            self._db.close()